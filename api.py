@@ -1,305 +1,1104 @@
+import atexit
+import json
 import os
 import sys
 import time
+import queue
 import threading
-from flask import Flask, jsonify
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.common.exceptions import (
-    NoSuchElementException,
-    TimeoutException,
-    ElementClickInterceptedException,
-)
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from dotenv import load_dotenv
-
-# Load environment variables from environment_keys.env
-load_dotenv('environment_keys.env')
-
-LOGIN_URL = "https://smarteefi.web.app/login"
-EMAIL = os.getenv("SMARTEEFI_EMAIL")
-PASSWORD = os.getenv("SMARTEEFI_PASSWORD")
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from flask import Flask, Response, g, jsonify, request
+
+import metrics
+from eventlog import EventLog
+from scheduler import Scheduler, ScheduleError, parse_timing
+from smarteefi import API_SOCKET, DEVICES_FILE, EMAIL, HTTP_API, LEAN, PASSWORD, TRANSPORT, load_device_config
+from transports import HttpTransport
+from waits import Deadline
+
+POOL_SIZE = int(os.getenv("SMARTEEFI_POOL_SIZE", "1"))
+STANDBY_SIZE = int(os.getenv("SMARTEEFI_STANDBY_SIZE", "1"))  # Logged-in spares for instant failover
+WATCHDOG_INTERVAL = float(os.getenv("SMARTEEFI_WATCHDOG_INTERVAL", "10"))  # Seconds between health checks, 0 disables
+JOB_QUEUE_SIZE = int(os.getenv("SMARTEEFI_JOB_QUEUE_SIZE", "50"))  # Queued async commands before 429s
+JOB_WORKERS = int(os.getenv("SMARTEEFI_JOB_WORKERS", str(POOL_SIZE)))
+JOB_RETENTION = float(os.getenv("SMARTEEFI_JOB_RETENTION", "600"))  # Seconds finished jobs stay pollable
+JOB_RETRY_AFTER = int(os.getenv("SMARTEEFI_JOB_RETRY_AFTER", "5"))  # Retry-After seconds when the queue is full
+MAX_LONG_POLL = 60.0
+# Load shedding: a command waits for its switch or a free session for at most
+# ACQUIRE_TIMEOUT (and never past its deadline), and is refused outright when
+# too many others are already waiting.
+ACQUIRE_TIMEOUT = float(os.getenv("SMARTEEFI_ACQUIRE_TIMEOUT", "20"))
+MAX_SESSION_WAITERS = int(os.getenv("SMARTEEFI_MAX_SESSION_WAITERS", str(4 * POOL_SIZE)))
+MAX_DEVICE_WAITERS = int(os.getenv("SMARTEEFI_MAX_DEVICE_WAITERS", "4"))
+MAX_STATE_WAITERS = int(os.getenv("SMARTEEFI_MAX_STATE_WAITERS", str(4 * POOL_SIZE)))
+RETRY_AFTER = int(os.getenv("SMARTEEFI_RETRY_AFTER", "5"))  # Retry-After seconds on 503s
+STATE_TTL = float(os.getenv("SMARTEEFI_STATE_TTL", "1.0"))  # Seconds a /state snapshot is reused
+WATCH_INTERVAL = float(os.getenv("SMARTEEFI_WATCH_INTERVAL", "0.5"))  # Seconds between observer drains, 0 disables
+WATCH_STALE = float(os.getenv("SMARTEEFI_WATCH_STALE", "5.0"))  # Trust the observer feed for this long after a drain
+STREAM_QUEUE_SIZE = int(os.getenv("SMARTEEFI_STREAM_QUEUE_SIZE", "100"))  # Events buffered per /events client
+STREAM_KEEPALIVE = float(os.getenv("SMARTEEFI_STREAM_KEEPALIVE", "15"))  # Seconds between keep-alive comments
 
 if not EMAIL or not PASSWORD:
     print("Error: SMARTEEFI_EMAIL and SMARTEEFI_PASSWORD must be set in environment_keys.env")
     sys.exit(1)
 
+try:
+    HOMES, DEFAULT_HOME = load_device_config(DEVICES_FILE)
+except (OSError, ValueError) as e:
+    print(f"Error: could not load device config {DEVICES_FILE}: {e}")
+    sys.exit(1)
+
 app = Flask(__name__)
 
-# Initialize a threading lock to manage WebDriver access
-driver_lock = threading.Lock()
-driver = None  # Will hold the WebDriver instance
+# Pool of logged-in transport sessions (WebDrivers for the Selenium
+# backend); a request checks one out for the duration of its work and puts
+# it back when done.
+driver_pool = queue.Queue()
+drivers = []  # Every session owned by the pool, idle or checked out
+standby_pool = queue.Queue()  # Logged-in sessions waiting to replace a failed one
+session_index = {}  # Session -> slot index, used for its profile directory and metrics
 
-def init_driver():
-    chrome_options = Options()
-    chrome_options.add_argument("--start-maximized")
-    # Uncomment the next line to run Chrome in headless mode
-    # chrome_options.add_argument("--headless")
-    driver_instance = webdriver.Chrome(options=chrome_options)
-    return driver_instance
+# Asynchronous commands: POSTs with ?async=1 (or Prefer: respond-async) are
+# queued as jobs and answered with 202; worker threads run them against the
+# session pool and clients poll GET /jobs/<id>.
+job_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+jobs = {}  # Job id -> job dict
+jobs_changed = threading.Condition()  # Guards jobs and wakes long-polls
 
-def perform_login(driver):
-    try:
-        driver.get(LOGIN_URL)
-        wait = WebDriverWait(driver, 60)
-
-        # Enter email
-        email_input = wait.until(
-            EC.element_to_be_clickable((By.XPATH, "//input[@placeholder='Enter your email']"))
-        )
-        email_input.clear()
-        email_input.send_keys(EMAIL)
-        print("Entered email.")
-
-        # Click Login/Signup button
-        login_button = driver.find_element(By.XPATH, "//ion-button[contains(., 'Login/Signup')]")
-        login_button.click()
-        print("Clicked Login/Signup button.")
-
-        # Wait for password page to load
-        wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Enter your password']")))
-        print("Password page loaded.")
-
-        # Enter password
-        password_input = driver.find_element(By.XPATH, "//input[@placeholder='Enter your password']")
-        password_input.clear()
-        password_input.send_keys(PASSWORD)
-        print("Entered password.")
-
-        # Click Login button
-        submit_button = driver.find_element(By.XPATH, "//ion-button[contains(., 'Login') and not(contains(., 'Signup'))]")
-        submit_button.click()
-        print("Clicked Login button.")
-
-        # Wait for dashboard to load
-        wait.until(EC.presence_of_element_located((By.XPATH, "//ion-tab-bar")))
-        print("Login successful.")
-        time.sleep(5)  # Reduced sleep time for efficiency
-    except TimeoutException:
-        print("Login failed: Timeout while trying to log in.")
-        driver.quit()
-        sys.exit()
-    except NoSuchElementException as e:
-        print(f"Login failed: Element not found. {e}")
-        driver.quit()
-        sys.exit()
-    except Exception as e:
-        print(f"An unexpected error occurred during login: {e}")
-        driver.quit()
-        sys.exit()
+# Commands for the same switch are serialised so they cannot race each other
+# on two different sessions; commands for different switches run in parallel.
+device_locks = {}
+device_locks_guard = threading.Lock()
+
+# Per-switch command coalescing: each switch has at most one running and one
+# queued command. Newer commands overwrite the queued command's state (last
+# writer wins) and every caller waiting on it gets its result; a command
+# identical to the running one just waits for that.
+device_commands = {}  # (home, label) -> {"running": command or None, "queued": command or None}
+device_commands_guard = threading.Lock()
+
+# Requests currently waiting, keyed "session", "state" or (home, label)
+waiters = {}
+waiters_guard = threading.Lock()
+
+# Metrics exposed on /metrics
+LOCK_WAIT_SECONDS = metrics.Histogram(
+    "smarteefi_lock_wait_seconds", "Time spent waiting for a device lock, a free session or a state refresh.", ["lock"])
+LOCK_WAITERS = metrics.Gauge(
+    "smarteefi_lock_waiters", "Requests currently waiting for a device lock, a free session or a state refresh.", ["lock"])
+COALESCED_TOTAL = metrics.Counter(
+    "smarteefi_coalesced_commands_total",
+    "Switch commands answered by another command's execution.", ["kind"])
+SHED_TOTAL = metrics.Counter(
+    "smarteefi_shed_requests_total", "Requests refused with 503 instead of waiting.", ["reason"])
+REQUEST_SECONDS = metrics.Histogram(
+    "smarteefi_request_seconds", "HTTP request duration.", ["route"])
+REQUESTS_TOTAL = metrics.Counter(
+    "smarteefi_requests_total", "HTTP requests handled.", ["route", "status"])
+session_started_at = {}  # Session index -> time.monotonic() when it became ready
+SESSION_AGE_SECONDS = metrics.Gauge(
+    "smarteefi_session_age_seconds", "Seconds since each browser session logged in.", ["session"],
+    callback=lambda: [((index,), round(time.monotonic() - started, 3))
+                      for index, started in sorted(session_started_at.items())])
+session_page_load = {}  # Session index -> page load time in ms when it was set up
+SESSION_RSS_BYTES = metrics.Gauge(
+    "smarteefi_session_rss_bytes", "Resident memory of each session's chromedriver and Chrome processes.",
+    ["session"], callback=lambda: [((session_index[driver],), rss) for driver, rss in session_rss()])
+SESSIONS_IDLE = metrics.Gauge(
+    "smarteefi_sessions_idle", "Browser sessions not currently checked out.",
+    callback=lambda: [((), driver_pool.qsize())])
+JOBS_QUEUED = metrics.Gauge(
+    "smarteefi_jobs_queued", "Asynchronous commands waiting for a worker.",
+    callback=lambda: [((), job_queue.qsize())])
+JOBS_TOTAL = metrics.Counter(
+    "smarteefi_jobs_total", "Asynchronous commands by outcome.", ["outcome"])
+SESSIONS_STANDBY = metrics.Gauge(
+    "smarteefi_sessions_standby", "Logged-in standby sessions ready for failover.",
+    callback=lambda: [((), standby_pool.qsize())])
+STREAM_CLIENTS = metrics.Gauge(
+    "smarteefi_stream_clients", "Clients connected to /events.",
+    callback=lambda: [((), len(subscribers))])
+
+# In-process switch state table, one entry per home. It is fed by the page
+# observers (live_at is when a tab was last drained) and, when that feed is
+# stale, by single-flight snapshot reads for /state (taken_at). stamps holds
+# the page time in ms of the newest value per switch so late events cannot win.
+state_cache = {}
+state_cache_lock = threading.Lock()
+state_refresh_lock = threading.Lock()
+
+# Our own commands in flight, guarded by state_cache_lock. When an observer
+# drain on another session sees a command's change before the command has
+# finished, the event is left to the command so the log keeps its source and
+# latency instead of recording it as "observed".
+pending_changes = {}  # (home, label) -> {"state": "on"/"off", "absorbed": bool}
+
+# /events subscribers: one bounded queue per connected client, keyed to the
+# home it follows. Changes read once from the page are fanned out to all.
+subscribers = {}  # queue.Queue -> home
+subscribers_lock = threading.Lock()
+
+# Every published change is also appended to the on-disk event log
+event_log = EventLog()
+
+class ServiceBusy(Exception):
+    """Raised instead of waiting when a command cannot get its switch or a session in time.
+
+    Answered with 503 and a Retry-After header.
+    """
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def acquire_timeout(deadline):
+    # Requests already past their deadline never reach the browser
+    if deadline.expired():
+        SHED_TOTAL.inc(reason="deadline")
+        raise ServiceBusy("Request deadline passed before it reached the browser.")
+    return min(deadline.remaining(), ACQUIRE_TIMEOUT)
+
+WAITING_FOR = {"session": "a session", "device": "this switch", "state": "a switch state refresh"}
 
-def select_nikoo_home(driver):
+@contextmanager
+def waiting_for(lock_name, key, limit, phase_name):
+    with waiters_guard:
+        if waiters.get(key, 0) >= limit:
+            SHED_TOTAL.inc(reason=f"{lock_name}_backlog")
+            raise ServiceBusy(f"Too many requests waiting for {WAITING_FOR[lock_name]}.")
+        waiters[key] = waiters.get(key, 0) + 1
+    LOCK_WAITERS.inc(lock=lock_name)
     try:
-        wait = WebDriverWait(driver, 60)
+        with metrics.timed(LOCK_WAIT_SECONDS, phase_name, lock=lock_name):
+            yield
+    finally:
+        LOCK_WAITERS.dec(lock=lock_name)
+        with waiters_guard:
+            waiters[key] -= 1
+            if not waiters[key]:
+                del waiters[key]
 
-        # Wait until no overlays are present
+@contextmanager
+def checkout_driver(deadline=None):
+    timeout = acquire_timeout(deadline or Deadline())
+    with waiting_for("session", "session", MAX_SESSION_WAITERS, "session_wait"):
         try:
-            wait.until(EC.invisibility_of_element_located((By.CSS_SELECTOR, "ion-backdrop")))
-            print("No overlays present.")
-        except TimeoutException:
-            print("Overlay is still present. Waiting for it to disappear.")
-            wait.until(EC.invisibility_of_element_located((By.CSS_SELECTOR, "ion-backdrop")))
-            print("Overlay has disappeared.")
-
-        # Click Home dropdown
-        dropdown = wait.until(EC.element_to_be_clickable((By.XPATH, "//ion-select")))
-        dropdown.click()
-        print("Clicked Home dropdown.")
-
-        # Wait for alert popup
-        alert_xpath = "//div[contains(@class, 'alert-wrapper') and contains(@class, 'ion-overlay-wrapper')]"
-        wait.until(EC.visibility_of_element_located((By.XPATH, alert_xpath)))
-        print("Alert popup appeared.")
-
-        # Select 'Nikoo' option
-        nikoo_button_xpath = "//div[contains(@class, 'alert-wrapper')]//div[@class='alert-radio-label sc-ion-alert-md' and contains(text(), 'Nikoo')]/ancestor::button"
-        nikoo_buttons = driver.find_elements(By.XPATH, nikoo_button_xpath)
-        print(f"Number of 'Nikoo' buttons found: {len(nikoo_buttons)}")
-        if not nikoo_buttons:
-            print("No 'Nikoo' button found.")
-            return
-        nikoo_button = nikoo_buttons[0]
-        nikoo_button.click()
-        print("Selected 'Nikoo' option.")
-
-        # Click 'Okay' button to confirm
-        okay_button_xpath = "//div[contains(@class, 'alert-wrapper')]//button/span[text()='Okay']"
-        okay_buttons = driver.find_elements(By.XPATH, okay_button_xpath)
-        print(f"Number of 'Okay' buttons found: {len(okay_buttons)}")
-        if not okay_buttons:
-            print("No 'Okay' button found.")
-            return
-        okay_button = okay_buttons[0]
-        okay_button.click()
-        print("Clicked 'Okay' button.")
-
-        # Wait for alert popup to disappear
-        wait.until(EC.invisibility_of_element_located((By.XPATH, alert_xpath)))
-        print("'Nikoo' selection confirmed.")
-    except TimeoutException:
-        print("Failed to select 'Nikoo': Timeout while waiting for elements.")
-        driver.quit()
-        sys.exit()
-    except NoSuchElementException as e:
-        print(f"Failed to select 'Nikoo': Element not found. {e}")
-        driver.quit()
-        sys.exit()
-    except Exception as e:
-        print(f"An unexpected error occurred while selecting 'Nikoo': {e}")
-        driver.quit()
-        sys.exit()
+            driver = driver_pool.get(timeout=timeout)
+        except queue.Empty:
+            SHED_TOTAL.inc(reason="session_timeout")
+            raise ServiceBusy(f"No browser session became free within {timeout:.0f}s.")
+    try:
+        yield driver
+    finally:
+        driver_pool.put(driver)
+
+def get_device_lock(home, switch_label):
+    with device_locks_guard:
+        key = (home, switch_label)
+        if key not in device_locks:
+            device_locks[key] = threading.Lock()
+        return device_locks[key]
 
-def toggle_switch(driver, switch_label, hidden_input_name, desired_state):
+@contextmanager
+def hold_device_lock(home, switch_label, deadline=None):
+    lock = get_device_lock(home, switch_label)
+    timeout = acquire_timeout(deadline or Deadline())
+    with waiting_for("device", (home, switch_label), MAX_DEVICE_WAITERS, "device_lock_wait"):
+        if not lock.acquire(timeout=timeout):
+            SHED_TOTAL.inc(reason="device_timeout")
+            raise ServiceBusy(f"{switch_label} stayed busy for {timeout:.0f}s.")
     try:
-        wait = WebDriverWait(driver, 60)
-
-        # Locate the toggle element
-        ion_toggle_xpath = f"//ion-item[ion-label/h2[contains(text(), '{switch_label}')]]//ion-toggle"
-        ion_toggle_elements = driver.find_elements(By.XPATH, ion_toggle_xpath)
-        print(f"Number of ion-toggle elements found for '{switch_label}': {len(ion_toggle_elements)}")
-        if not ion_toggle_elements:
-            print(f"No ion-toggle element found for '{switch_label}'.")
-            return False, f"No ion-toggle element found for '{switch_label}'."
-        ion_toggle = ion_toggle_elements[0]
-
-        # Scroll the toggle into view using scrollIntoView
-        driver.execute_script("arguments[0].scrollIntoView({block: 'center', inline: 'nearest'});", ion_toggle)
-        print("Scrolled the toggle into view.")
-        time.sleep(1)  # Allow time for scrolling
-
-        # Use ActionChains to move to the toggle element
-        actions = ActionChains(driver)
-        actions.move_to_element(ion_toggle).perform()
-        print("Moved to the toggle element using ActionChains.")
-        time.sleep(1)  # Allow time for movement
-
-        # Wait until no overlays are present
-        try:
-            wait.until(EC.invisibility_of_element_located((By.CSS_SELECTOR, "ion-backdrop")))
-            print("No overlays present.")
-        except TimeoutException:
-            print("Overlay is still present. Waiting for it to disappear.")
-            wait.until(EC.invisibility_of_element_located((By.CSS_SELECTOR, "ion-backdrop")))
-            print("Overlay has disappeared.")
-
-        if ion_toggle.is_displayed() and ion_toggle.is_enabled():
-            print("Toggle is visible and enabled.")
-        else:
-            print("Toggle is either not visible or not enabled.")
-            return False, "Toggle is either not visible or not enabled."
+        yield
+    finally:
+        lock.release()
 
-        # JavaScript to get the hidden input's value within the toggle element
-        js = f"""
-            var elem = arguments[0].querySelector('input[name="{hidden_input_name}"]');
-            return elem ? elem.value : null;
-        """
-        current_value = driver.execute_script(js, ion_toggle)
-        is_on = current_value == "on"
-        print(f"The {switch_label} is currently {'ON' if is_on else 'OFF'}.")
+def home_state(home):
+    # Caller must hold state_cache_lock
+    if home not in state_cache:
+        state_cache[home] = {"states": None, "stamps": {}, "taken_at": None, "live_at": None}
+    return state_cache[home]
 
-        desired_state_bool = desired_state.lower() == "on"
+def observer_is_live(entry):
+    # Caller must hold state_cache_lock
+    live_at = entry["live_at"]
+    return live_at is not None and time.monotonic() - live_at <= WATCH_STALE
 
-        if desired_state_bool != is_on:
-            try:
-                # Click the toggle via JavaScript
-                driver.execute_script("arguments[0].click();", ion_toggle)
-                print(f"Clicked the toggle to turn the {switch_label} {'ON' if desired_state_bool else 'OFF'}.")
-
-                # Wait until the hidden input's value reflects the desired state
-                wait.until(lambda d: d.execute_script(js, ion_toggle) == ("on" if desired_state_bool else ""))
-                print(f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}.")
-                return True, f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}."
-            except TimeoutException:
-                print(f"Failed to set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}. The state did not change in time.")
-                return False, f"Failed to set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}."
-            except ElementClickInterceptedException:
-                print("Unable to click the toggle. It might be covered by another element.")
-                time.sleep(5)
+def cached_age(entry):
+    # Caller must hold state_cache_lock; None when nothing usable is cached
+    if entry["states"] is None:
+        return None
+    if observer_is_live(entry):
+        return time.monotonic() - entry["live_at"]
+    if entry["taken_at"] is None:
+        return None
+    return time.monotonic() - entry["taken_at"]
+
+def get_switch_states(home, max_age=STATE_TTL):
+    """Return (states, age) for home from the cache, re-reading the page if it is older than max_age."""
+    with state_cache_lock:
+        entry = home_state(home)
+        age = cached_age(entry)
+        if age is not None and age <= max_age:
+            return dict(entry["states"]), age
+    deadline = Deadline()
+    timeout = acquire_timeout(deadline)
+    with waiting_for("state", "state", MAX_STATE_WAITERS, "state_refresh_wait"):
+        if not state_refresh_lock.acquire(timeout=timeout):
+            SHED_TOTAL.inc(reason="state_timeout")
+            raise ServiceBusy(f"No switch state refresh finished within {timeout:.0f}s.")
+    try:
+        # Another request may have refreshed the cache while we waited
+        with state_cache_lock:
+            age = cached_age(entry)
+            if age is not None and age <= max_age:
+                return dict(entry["states"]), age
+        with checkout_driver(deadline) as session:
+            states = transport.read_states(session, home)
+        now_ms = time.time() * 1000
+        with state_cache_lock:
+            entry["states"] = dict(states)
+            entry["stamps"] = {label: now_ms for label in states}
+            entry["taken_at"] = time.monotonic()
+        return dict(states), 0.0
+    finally:
+        state_refresh_lock.release()
+
+def get_known_state(home, switch_label):
+    """Return 'on'/'off' from the observer-fed table, or None if it cannot be trusted."""
+    with state_cache_lock:
+        entry = home_state(home)
+        if not observer_is_live(entry):
+            return None
+        return entry["states"].get(switch_label)
+
+def apply_state_changes(home, changes):
+    changed = []
+    with state_cache_lock:
+        entry = home_state(home)
+        if entry["states"] is None:
+            entry["states"] = {}
+        for change in changes:
+            label = change["label"]
+            if change["ts"] < entry["stamps"].get(label, 0):
+                continue
+            state = "on" if change["value"] == "on" else "off"
+            if entry["states"].get(label) != state:
+                pending = pending_changes.get((home, label))
+                if pending is not None and pending["state"] == state:
+                    pending["absorbed"] = True
+                else:
+                    print(f"Observed {label} in {home} is now {state.upper()}.")
+                    changed.append((label, state))
+            entry["states"][label] = state
+            entry["stamps"][label] = change["ts"]
+        entry["live_at"] = time.monotonic()
+    for label, state in changed:
+        publish_state_change(home, label, state, "observed")
+
+def update_cached_state(home, switch_label, state, source="command", latency=None):
+    # Keep the table in step with our own writes so pollers see them at once
+    with state_cache_lock:
+        entry = home_state(home)
+        pending = pending_changes.pop((home, switch_label), None)
+        absorbed = pending is not None and pending["absorbed"] and pending["state"] == state
+        changed = absorbed or entry["states"] is None or entry["states"].get(switch_label) != state
+        if entry["states"] is not None:
+            entry["states"][switch_label] = state
+            entry["stamps"][switch_label] = time.time() * 1000
+    if changed:
+        publish_state_change(home, switch_label, state, source, latency)
+
+@contextmanager
+def expecting_changes(home, states):
+    """Mark states (label -> 'on'/'off') as in flight for the duration of a command.
+
+    Caller must hold the device locks. A change the observer absorbed for a
+    command that then failed is published as "observed" on the way out.
+    """
+    with state_cache_lock:
+        for label, state in states.items():
+            pending_changes[(home, label)] = {"state": state, "absorbed": False}
+    try:
+        yield
+    finally:
+        with state_cache_lock:
+            leftover = [(label, state) for label, state in states.items()
+                        if pending_changes.pop((home, label), {}).get("absorbed")]
+        for label, state in leftover:
+            print(f"Observed {label} in {home} is now {state.upper()}.")
+            publish_state_change(home, label, state, "observed")
+
+def publish_state_change(home, switch_label, state, source, latency=None):
+    event = {"home": home, "label": switch_label, "state": state, "source": source, "ts": time.time()}
+    event_log.append(event["ts"], home, switch_label, state, source, latency)
+    with subscribers_lock:
+        targets = [q for q, followed in subscribers.items() if followed == home]
+    for q in targets:
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            # A client that cannot keep up drops its backlog and gets a fresh snapshot
+            while not q.empty():
                 try:
-                    driver.execute_script("arguments[0].click();", ion_toggle)
-                    print(f"Successfully clicked the toggle after waiting. {switch_label} has been turned {'ON' if desired_state_bool else 'OFF'}.")
-
-                    # Wait again for the state
-                    wait.until(lambda d: d.execute_script(js, ion_toggle) == ("on" if desired_state_bool else ""))
-                    print(f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}.")
-                    return True, f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}."
-                except Exception as e:
-                    print(f"Still unable to click the toggle: {e}")
-                    return False, f"Still unable to click the toggle: {e}"
-            except Exception as e:
-                print(f"An error occurred while toggling the {switch_label}: {e}")
-                return False, f"An error occurred while toggling the {switch_label}: {e}"
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+
+def watch_state_changes():
+    # Sessions are drained in turn as they come free; a tick is skipped
+    # rather than waiting when every session is busy with a command.
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        try:
+            session = driver_pool.get_nowait()
+        except queue.Empty:
+            continue
+        try:
+            transport.drain_changes(session)
+        except Exception as e:
+            print(f"Failed to drain state changes: {e}")
+        finally:
+            driver_pool.put(session)
+
+def start_state_watcher():
+    if WATCH_INTERVAL <= 0:
+        print("State observer disabled.")
+        return
+    threading.Thread(target=watch_state_changes, name="state-watcher", daemon=True).start()
+
+def run_toggle(home, switch_label, hidden_input_name, desired_state):
+    """Set one switch, sharing the execution with overlapping commands for it (see device_commands)."""
+    key = (home, switch_label)
+    with device_commands_guard:
+        slot = device_commands.setdefault(key, {"running": None, "queued": None})
+        command = slot["queued"]
+        if command is not None:
+            kind = "joined" if command["desired_state"] == desired_state else "superseded"
+            command["desired_state"] = desired_state
+        elif slot["running"] is not None and slot["running"]["desired_state"] == desired_state:
+            command, kind = slot["running"], "joined"
         else:
-            print(f"{switch_label.capitalize()} is already {'ON' if is_on else 'OFF'}.")
-            return True, f"{switch_label.capitalize()} is already {'ON' if is_on else 'OFF'}."
-    except TimeoutException:
-        print("The toggle element was not found within the given time.")
-        return False, "The toggle element was not found within the given time."
-    except NoSuchElementException as e:
-        print(f"Toggle element not found: {e}")
-        return False, f"Toggle element not found: {e}"
+            command = {"desired_state": desired_state, "done": threading.Event(), "result": None, "busy": None}
+            kind = None
+            slot["queued"] = command
+    if kind is not None:
+        COALESCED_TOTAL.inc(kind=kind)
+        # Joiners count against the switch's waiter limit like lock waiters do
+        timeout = acquire_timeout(Deadline())
+        with waiting_for("device", key, MAX_DEVICE_WAITERS, "coalesced_wait"):
+            if not command["done"].wait(timeout=timeout):
+                SHED_TOTAL.inc(reason="device_timeout")
+                raise ServiceBusy(f"{switch_label} stayed busy for {timeout:.0f}s.")
+        if command["busy"] is not None:
+            raise ServiceBusy(str(command["busy"]), command["busy"].retry_after)
+        body, status_code = command["result"]
+        return dict(body, coalesced=True), status_code
+
+    deadline = Deadline()
+    try:
+        with hold_device_lock(home, switch_label, deadline):
+            with device_commands_guard:
+                # From here on the state is fixed; later commands queue behind this one
+                slot["queued"] = None
+                slot["running"] = command
+                desired_state = command["desired_state"]
+            command["result"] = execute_toggle(home, switch_label, hidden_input_name, desired_state, deadline)
+    except ServiceBusy as e:
+        command["busy"] = e
+        raise
     except Exception as e:
-        print(f"An unexpected error occurred while toggling the {switch_label}: {e}")
-        return False, f"An unexpected error occurred while toggling the {switch_label}: {e}"
+        command["result"] = {"success": False, "message": f"An unexpected error occurred: {e}"}, 500
+        raise
+    finally:
+        with device_commands_guard:
+            if slot["running"] is command:
+                slot["running"] = None
+            if slot["queued"] is command:
+                slot["queued"] = None
+            if slot["running"] is None and slot["queued"] is None:
+                device_commands.pop(key, None)
+        command["done"].set()
+    return command["result"]
+
+def execute_toggle(home, switch_label, hidden_input_name, desired_state, deadline):
+    # Caller must hold the device lock
+    # Answer "already ON/OFF" from the observer feed without a browser trip
+    if get_known_state(home, switch_label) == desired_state:
+        message = f"{switch_label.capitalize()} is already {desired_state.upper()}."
+        print(message)
+        return {"success": True, "message": message}, 200
+    with expecting_changes(home, {switch_label: desired_state}):
+        with checkout_driver(deadline) as session:
+            success, message = transport.set_switch(session, home, switch_label, hidden_input_name,
+                                                    desired_state, deadline)
+        if success:
+            # Latency is measured from the start of the command, lock wait included
+            update_cached_state(home, switch_label, desired_state,
+                                latency=deadline.seconds - deadline.remaining())
+    status_code = 200 if success else 400
+    return {"success": success, "message": message}, status_code
 
+def wants_async():
+    return (request.args.get("async", "").lower() in ("1", "true")
+            or "respond-async" in request.headers.get("Prefer", ""))
+
+def respond(action, *args):
+    """Run action(*args) now, or queue it as a job when the caller asked for async."""
+    if wants_async():
+        return submit_job(action, args)
+    body, status_code = action(*args)
+    return jsonify(body), status_code
+
+def unknown_home(home):
+    return jsonify({"success": False, "message": f"Unknown home '{home}'."}), 404
+
+def run_device(home, name, desired_state):
+    if home not in HOMES:
+        return unknown_home(home)
+    device = HOMES[home]["devices"].get(name)
+    if device is None:
+        return jsonify({"success": False, "message": f"Unknown device '{name}' in home '{home}'."}), 404
+    return respond(run_toggle, home, device["label"], device["input"], desired_state)
+
+@app.route('/homes', methods=['GET'])
+def list_homes():
+    return jsonify({"default_home": DEFAULT_HOME, "homes": HOMES})
+
+@app.route('/devices', methods=['GET'])
+def list_devices():
+    return jsonify(HOMES[DEFAULT_HOME])
+
+@app.route('/homes/<home>/devices/<name>/<any(on, off):desired_state>', methods=['POST'])
+def home_device_command(home, name, desired_state):
+    return run_device(home, name, desired_state)
+
+@app.route('/devices/<name>/<any(on, off):desired_state>', methods=['POST'])
+def device_command(name, desired_state):
+    return run_device(DEFAULT_HOME, name, desired_state)
+
+# Original fixed routes, kept for existing callers
 @app.route('/lighton', methods=['POST'])
 def light_on():
-    with driver_lock:
-        success, message = toggle_switch(driver, 'Switch-1', 'ion-tg-5', 'on')
-    status_code = 200 if success else 400
-    return jsonify({"success": success, "message": message}), status_code
+    return run_device(DEFAULT_HOME, 'light', 'on')
 
 @app.route('/lightoff', methods=['POST'])
 def light_off():
-    with driver_lock:
-        success, message = toggle_switch(driver, 'Switch-1', 'ion-tg-5', 'off')
-    status_code = 200 if success else 400
-    return jsonify({"success": success, "message": message}), status_code
+    return run_device(DEFAULT_HOME, 'light', 'off')
 
 @app.route('/fanon', methods=['POST'])
 def fan_on():
-    with driver_lock:
-        success, message = toggle_switch(driver, 'Fan-1', 'ion-tg-9', 'on')
-    status_code = 200 if success else 400
-    return jsonify({"success": success, "message": message}), status_code
+    return run_device(DEFAULT_HOME, 'fan', 'on')
 
 @app.route('/fanoff', methods=['POST'])
 def fan_off():
-    with driver_lock:
-        success, message = toggle_switch(driver, 'Fan-1', 'ion-tg-9', 'off')
-    status_code = 200 if success else 400
-    return jsonify({"success": success, "message": message}), status_code
+    return run_device(DEFAULT_HOME, 'fan', 'off')
 
 @app.route('/chargeron', methods=['POST'])
 def charger_on():
-    with driver_lock:
-        success, message = toggle_switch(driver, 'Switch-2', 'ion-tg-6', 'on')
-    status_code = 200 if success else 400
-    return jsonify({"success": success, "message": message}), status_code
+    return run_device(DEFAULT_HOME, 'charger', 'on')
 
 @app.route('/chargeroff', methods=['POST'])
 def charger_off():
-    with driver_lock:
-        success, message = toggle_switch(driver, 'Switch-2', 'ion-tg-6', 'off')
-    status_code = 200 if success else 400
-    return jsonify({"success": success, "message": message}), status_code
+    return run_device(DEFAULT_HOME, 'charger', 'off')
+
+def resolve_batch(home, desired_states):
+    """Return (label -> state map, None) for a batch body, or (None, error message)."""
+    if not isinstance(desired_states, dict) or not desired_states:
+        return None, "Expected a JSON object of switch -> 'on'/'off'."
+    # Keys may be device names from the config or raw switch labels
+    devices = HOMES[home]["devices"]
+    desired_states = {devices[key]["label"] if key in devices else key: state
+                      for key, state in desired_states.items()}
+    invalid = [label for label, state in desired_states.items()
+               if not isinstance(state, str) or state.lower() not in ("on", "off")]
+    if invalid:
+        return None, f"State must be 'on' or 'off' for: {', '.join(invalid)}"
+    return desired_states, None
+
+def run_batch(home, desired_states):
+    if home not in HOMES:
+        return unknown_home(home)
+    desired_states, error = resolve_batch(home, desired_states)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    return respond(apply_batch, home, desired_states)
+
+def apply_batch(home, desired_states, source="command"):
+    deadline = Deadline()
+    with ExitStack() as stack:
+        # Sorted so two overlapping batches always lock switches in the same order
+        for label in sorted(desired_states):
+            stack.enter_context(hold_device_lock(home, label, deadline))
+        results = {}
+        to_apply = {}
+        for label, state in desired_states.items():
+            if get_known_state(home, label) == state.lower():
+                results[label] = (True, f"{label.capitalize()} is already {state.upper()}.")
+            else:
+                to_apply[label] = state
+        if to_apply:
+            stack.enter_context(expecting_changes(home, {label: state.lower() for label, state in to_apply.items()}))
+            session = stack.enter_context(checkout_driver(deadline))
+            applied = transport.apply_states(session, home, to_apply, deadline)
+            for label, (ok, _) in applied.items():
+                if ok:
+                    update_cached_state(home, label, to_apply[label].lower(), source,
+                                        deadline.seconds - deadline.remaining())
+            results.update(applied)
+
+    success = all(ok for ok, _ in results.values())
+    body = {
+        "success": success,
+        "results": {label: {"success": ok, "message": message} for label, (ok, message) in results.items()},
+    }
+    return body, 200 if success else 400
+
+def job_view(job):
+    view = {key: job[key] for key in ("id", "status", "command", "submitted_at", "started_at", "finished_at")}
+    if job["status"] == "done":
+        view["status_code"] = job["status_code"]
+        view["result"] = job["result"]
+    return view
+
+def prune_jobs():
+    # Caller must hold jobs_changed
+    cutoff = time.time() - JOB_RETENTION
+    for job_id in [job_id for job_id, job in jobs.items()
+                   if job["status"] == "done" and job["finished_at"] < cutoff]:
+        del jobs[job_id]
+
+def submit_job(action, args):
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "command": f"{request.method} {request.path}",
+        "submitted_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    with jobs_changed:
+        prune_jobs()
+        jobs[job["id"]] = job
+    try:
+        job_queue.put_nowait((job, action, args))
+    except queue.Full:
+        # Bounded queue: refuse new work instead of letting it pile up
+        with jobs_changed:
+            del jobs[job["id"]]
+        JOBS_TOTAL.inc(outcome="rejected")
+        response = jsonify({"success": False, "message": "Command queue is full. Retry later."})
+        response.headers["Retry-After"] = str(JOB_RETRY_AFTER)
+        return response, 429
+    response = jsonify(job_view(job))
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return response, 202
+
+def run_jobs():
+    while True:
+        job, action, args = job_queue.get()
+        with jobs_changed:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            jobs_changed.notify_all()
+        metrics.begin_request()
+        try:
+            body, status_code = action(*args)
+        except ServiceBusy as e:
+            print(f"Job {job['id']} shed: {e}")
+            body, status_code = {"success": False, "message": str(e)}, 503
+        except Exception as e:
+            print(f"Job {job['id']} failed: {e}")
+            body, status_code = {"success": False, "message": f"An unexpected error occurred: {e}"}, 500
+        phases = metrics.end_request()
+        body["timing"] = {name: round(seconds, 4) for name, seconds in (phases or {}).items()}
+        JOBS_TOTAL.inc(outcome="succeeded" if status_code < 400 else "failed")
+        with jobs_changed:
+            job["status"] = "done"
+            job["status_code"] = status_code
+            job["result"] = body
+            job["finished_at"] = time.time()
+            jobs_changed.notify_all()
+
+def serve_unix_socket(path):
+    """Also serve the API on a Unix socket, for fast local clients like main.py."""
+    from werkzeug.serving import make_server
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = make_server(f"unix://{path}", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="unix-socket", daemon=True).start()
+    print(f"Serving the API on unix://{path}")
+
+def start_job_workers(count=JOB_WORKERS):
+    for number in range(count):
+        threading.Thread(target=run_jobs, name=f"job-worker-{number}", daemon=True).start()
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    # ?wait=N long-polls for up to N seconds until the job is done
+    wait = min(request.args.get('wait', default=0.0, type=float), MAX_LONG_POLL)
+    with jobs_changed:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": f"Unknown job '{job_id}'."}), 404
+        if wait > 0:
+            jobs_changed.wait_for(lambda: job["status"] == "done", timeout=wait)
+        return jsonify(job_view(job)), 200
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    return run_batch(DEFAULT_HOME, request.get_json(silent=True))
+
+@app.route('/homes/<home>/batch', methods=['POST'])
+def home_batch(home):
+    return run_batch(home, request.get_json(silent=True))
+
+def run_scene(home, name):
+    if home not in HOMES:
+        return unknown_home(home)
+    scenes = HOMES[home]["scenes"]
+    if name not in scenes:
+        return jsonify({"success": False, "message": f"Unknown scene '{name}' in home '{home}'."}), 404
+    return run_batch(home, scenes[name])
+
+@app.route('/scenes/<name>', methods=['POST'])
+def scene(name):
+    return run_scene(DEFAULT_HOME, name)
+
+@app.route('/homes/<home>/scenes/<name>', methods=['POST'])
+def home_scene(home, name):
+    return run_scene(home, name)
+
+def run_scheduled(home, actions):
+    # Resolved when the rule fires so devices.json edits apply to existing schedules
+    if home not in HOMES:
+        print(f"Skipping scheduled batch: unknown home '{home}'.")
+        return
+    desired_states, error = resolve_batch(home, actions)
+    if error:
+        print(f"Skipping scheduled batch for {home}: {error}")
+        return
+    body, _ = apply_batch(home, desired_states, "scheduled")
+    print(f"Scheduled batch for {home} finished: {'OK' if body['success'] else 'with failures'}.")
+
+scheduler = Scheduler(run_scheduled)
+
+@app.route('/schedules', methods=['GET'])
+def list_schedules():
+    return jsonify({"success": True, "schedules": scheduler.list()}), 200
+
+@app.route('/schedules', methods=['POST'])
+def add_schedule():
+    spec = request.get_json(silent=True)
+    if not isinstance(spec, dict):
+        return jsonify({"success": False, "message": "Expected a JSON object."}), 400
+    home = spec.get("home", DEFAULT_HOME)
+    if home not in HOMES:
+        return unknown_home(home)
+    actions = spec.get("actions")
+    if spec.get("scene") is not None:
+        actions = HOMES[home]["scenes"].get(spec["scene"])
+        if actions is None:
+            return jsonify({"success": False, "message": f"Unknown scene '{spec['scene']}' in home '{home}'."}), 404
+    # Stored as switch labels so the scheduler merges rules on the same keys
+    actions, error = resolve_batch(home, actions)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    try:
+        rule = scheduler.add(home, actions, parse_timing(spec))
+    except ScheduleError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "schedule": rule}), 201
+
+@app.route('/schedules/<rule_id>', methods=['DELETE'])
+def delete_schedule(rule_id):
+    if not scheduler.remove(rule_id):
+        return jsonify({"success": False, "message": f"Unknown schedule '{rule_id}'."}), 404
+    return jsonify({"success": True, "message": f"Schedule {rule_id} deleted."}), 200
+
+def run_state(home):
+    if home not in HOMES:
+        return unknown_home(home)
+    max_age = request.args.get('max_age', default=STATE_TTL, type=float)
+    try:
+        states, age = get_switch_states(home, max_age)
+    except ServiceBusy:
+        raise
+    except Exception as e:
+        print(f"Failed to read switch states: {e}")
+        return jsonify({"success": False, "message": f"Failed to read switch states: {e}"}), 500
+    return jsonify({"success": True, "home": home, "switches": states, "age": round(age, 3)}), 200
+
+@app.route('/state', methods=['GET'])
+def state():
+    return run_state(DEFAULT_HOME)
+
+@app.route('/homes/<home>/state', methods=['GET'])
+def home_state_endpoint(home):
+    return run_state(home)
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+def state_snapshot_event(home):
+    try:
+        # Any cached table will do; only an empty cache costs a page read
+        states, age = get_switch_states(home, float("inf"))
+    except Exception as e:
+        print(f"Failed to read switch states: {e}")
+        return format_event("error", {"home": home, "message": f"Failed to read switch states: {e}"})
+    return format_event("snapshot", {"home": home, "switches": states, "age": round(age, 3)})
+
+def run_events(home):
+    """Stream switch changes for home as Server-Sent Events, starting with a snapshot."""
+    if home not in HOMES:
+        return unknown_home(home)
+    q = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    # Subscribe before taking the snapshot so no change falls in between
+    with subscribers_lock:
+        subscribers[q] = home
+
+    def generate():
+        try:
+            yield state_snapshot_event(home)
+            while True:
+                try:
+                    event = q.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    yield state_snapshot_event(home)
+                else:
+                    yield format_event("change", event)
+        finally:
+            with subscribers_lock:
+                subscribers.pop(q, None)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/events', methods=['GET'])
+def events():
+    return run_events(DEFAULT_HOME)
+
+@app.route('/homes/<home>/events', methods=['GET'])
+def home_events(home):
+    return run_events(home)
+
+def parse_time_arg(name, default):
+    # Epoch seconds or a local ISO date/date-time
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def history_range(default_span):
+    until = parse_time_arg('until', time.time())
+    return parse_time_arg('since', until - default_span), until
+
+@app.route('/history', methods=['GET'])
+def history():
+    try:
+        since, until = history_range(86400)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid time: {e}"}), 400
+    limit = request.args.get('limit', default=1000, type=int)
+    if limit < 1:
+        return jsonify({"success": False, "message": "limit must be at least 1."}), 400
+    device = request.args.get('device')
+    if device is not None:
+        # Filter on one switch: a device name from devices.json or a label
+        home = request.args.get('home', DEFAULT_HOME)
+        if home not in HOMES:
+            return unknown_home(home)
+        devices = HOMES[home]["devices"]
+        device = f"{home}/{devices[device]['label'] if device in devices else device}"
+    events = event_log.query(since, until, device, limit)
+    return jsonify({"success": True, "since": since, "until": until, "events": events}), 200
+
+@app.route('/history/on-time', methods=['GET'])
+def history_on_time():
+    try:
+        since, until = history_range(7 * 86400)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid time: {e}"}), 400
+    return jsonify({"success": True, "since": since, "until": until,
+                    "seconds_on": event_log.on_durations(since, until)}), 200
+
+@app.route('/sessions', methods=['GET'])
+def sessions():
+    # Memory and page-load figures for sizing how many sessions fit on a host
+    rss = dict(session_rss())
+    standby = set(standby_pool.queue)
+    report = []
+    for driver in list(drivers):
+        index = session_index.get(driver)
+        if index is None:
+            continue
+        started = session_started_at.get(index)
+        report.append({
+            "session": index,
+            "standby": driver in standby,
+            "age": round(time.monotonic() - started, 1) if started is not None else None,
+            "rss_mb": round(rss[driver] / 2**20, 1) if driver in rss else None,
+            "page_load_ms": session_page_load.get(index),
+        })
+    return jsonify({"success": True, "transport": transport.name, "lean": LEAN, "sessions": report}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.errorhandler(ServiceBusy)
+def service_busy(e):
+    response = jsonify({"success": False, "message": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+
+@app.after_request
+def finish_request_timing(response):
+    phases = metrics.end_request()
+    started = getattr(g, "request_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if route != "/metrics":
+        REQUEST_SECONDS.observe(elapsed, route=route)
+        REQUESTS_TOTAL.inc(route=route, status=response.status_code)
+    # ?timing=1 adds a per-phase breakdown of this request to a JSON response
+    if request.args.get("timing") and response.is_json:
+        body = response.get_json()
+        if isinstance(body, dict):
+            timing = {name: round(seconds, 4) for name, seconds in (phases or {}).items()}
+            timing["total"] = round(elapsed, 4)
+            body["timing"] = timing
+            response.set_data(json.dumps(body))
+    return response
 
 @app.route('/')
 def index():
     return jsonify({"message": "Smarteefi Control API is running."})
 
-def setup_driver():
-    global driver
-    driver = init_driver()
-    perform_login(driver)
-    select_nikoo_home(driver)
-    print("Driver setup complete and ready to handle requests.")
+def process_tree_rss(pid):
+    """Return the summed RSS in bytes of pid and its descendants, or None off Linux.
+
+    Pages shared between Chrome processes are counted once per process, so
+    this overstates the true footprint somewhat.
+    """
+    try:
+        entries = os.listdir("/proc")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        return None
+    children = {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent pid is the second field after the parenthesised command name
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+        pending.extend(children.get(current, []))
+    return total
+
+def session_rss():
+    """Return [(driver, rss bytes)] for every live session whose size can be read."""
+    sizes = []
+    for driver in list(drivers):
+        process = getattr(getattr(driver, "service", None), "process", None)
+        rss = process_tree_rss(process.pid) if process is not None else None
+        if rss is not None and driver in session_index:
+            sizes.append((driver, rss))
+    return sizes
+
+def create_session(index):
+    start = time.monotonic()
+    session = transport.open_session(index)
+    session_started_at[index] = time.monotonic()
+    session_page_load[index] = transport.page_load_ms(session)
+    session_index[session] = index
+    drivers.append(session)
+    print(f"Session {index} logged in and ready in {time.monotonic() - start:.1f}s ({transport.name}).")
+    return session
+
+def retire_session(session):
+    """Forget a failed session, close it and return its slot index."""
+    index = session_index.pop(session, None)
+    session_started_at.pop(index, None)
+    session_page_load.pop(index, None)
+    if session in drivers:
+        drivers.remove(session)
+    try:
+        transport.close_session(session)
+    except Exception as e:
+        print(f"Error while closing a failed session: {e}")
+    return index
+
+def relogin_in_background(index, target):
+    """Log a fresh session into slot index off the request path, then add it to target."""
+    def relogin():
+        while True:
+            try:
+                driver = create_session(index)
+                break
+            except Exception as e:
+                print(f"Re-login of session {index} failed: {e}. Retrying in {WATCHDOG_INTERVAL:.0f}s.")
+                time.sleep(WATCHDOG_INTERVAL)
+        target.put(driver)
+        print(f"Session {index} is back {'on standby' if target is standby_pool else 'in the pool'}.")
+    threading.Thread(target=relogin, name=f"relogin-{index}", daemon=True).start()
+
+def session_is_usable(session):
+    # A backend that raises from its health check counts as unhealthy
+    try:
+        return transport.is_healthy(session)
+    except Exception as e:
+        print(f"Health check failed: {e}")
+        return False
+
+def check_sessions():
+    # Idle pool sessions; busy ones are checked on a later pass. Every session
+    # taken out goes back, or is retired and handed to a re-login, so a
+    # failing check can never drain the pool.
+    for _ in range(driver_pool.qsize()):
+        try:
+            driver = driver_pool.get_nowait()
+        except queue.Empty:
+            break
+        retired = False
+        try:
+            if session_is_usable(driver):
+                continue
+            index = session_index.get(driver)
+            try:
+                standby = standby_pool.get_nowait()
+            except queue.Empty:
+                standby = None
+            retired = True
+            if standby is not None:
+                # Failover is just a queue hand-off; the cold login happens in the background
+                driver_pool.put(standby)
+                print(f"Session {index} is unhealthy. Swapped in standby session {session_index.get(standby)}.")
+                relogin_in_background(retire_session(driver), standby_pool)
+            else:
+                print(f"Session {index} is unhealthy and no standby is ready. Logging it in again.")
+                relogin_in_background(retire_session(driver), driver_pool)
+        finally:
+            if not retired:
+                driver_pool.put(driver)
+    for _ in range(standby_pool.qsize()):
+        try:
+            standby = standby_pool.get_nowait()
+        except queue.Empty:
+            break
+        retired = False
+        try:
+            if not session_is_usable(standby):
+                retired = True
+                print(f"Standby session {session_index.get(standby)} is unhealthy. Logging it in again.")
+                relogin_in_background(retire_session(standby), standby_pool)
+        finally:
+            if not retired:
+                standby_pool.put(standby)
+
+def watch_sessions():
+    while True:
+        time.sleep(WATCHDOG_INTERVAL)
+        try:
+            check_sessions()
+        except Exception as e:
+            print(f"Session watchdog error: {e}")
+
+def start_watchdog():
+    if WATCHDOG_INTERVAL <= 0:
+        print("Session watchdog disabled.")
+        return
+    threading.Thread(target=watch_sessions, name="session-watchdog", daemon=True).start()
+
+def shutdown_pool():
+    for session in list(drivers):
+        try:
+            transport.close_session(session)
+        except Exception as e:
+            print(f"Error while closing a session: {e}")
+    drivers.clear()
+
+def make_transport(name):
+    if name == "selenium":
+        # Imported here so the HTTP backend runs without Selenium installed
+        from selenium_transport import SeleniumTransport
+        return SeleniumTransport(HOMES, apply_state_changes if WATCH_INTERVAL > 0 else None)
+    if name == "http":
+        if not HTTP_API:
+            print("Error: SMARTEEFI_TRANSPORT=http needs SMARTEEFI_HTTP_API, the base URL of the device-state API.")
+            sys.exit(1)
+        return HttpTransport(HOMES, apply_state_changes)
+    print(f"Error: unknown SMARTEEFI_TRANSPORT '{name}'. Use 'selenium' or 'http'.")
+    sys.exit(1)
+
+transport = make_transport(TRANSPORT)
+
+def setup_pool(size=POOL_SIZE, standby_size=STANDBY_SIZE):
+    # Log the sessions in concurrently so startup costs one login, not N
+    total = size + standby_size
+    with ThreadPoolExecutor(max_workers=total) as executor:
+        futures = [executor.submit(create_session, index) for index in range(total)]
+    failed = False
+    for index, future in enumerate(futures):
+        try:
+            driver = future.result()
+        except Exception as e:
+            print(f"Failed to start session {index}: {e}")
+            failed = True
+            continue
+        if index < size:
+            driver_pool.put(driver)
+        else:
+            standby_pool.put(driver)
+    if failed:
+        shutdown_pool()
+        sys.exit(1)
+    print(f"Driver pool setup complete with {size} session(s) and {standby_size} standby, ready to handle requests.")
 
 if __name__ == "__main__":
-    # Initialize the WebDriver only once before starting the app
-    setup_driver()
-    # Run the Flask app
-    app.run(host='0.0.0.0', port=9000)
+    # Log in every session once before starting the app
+    event_log.open()
+    setup_pool()
+    atexit.register(shutdown_pool)
+    start_state_watcher()
+    start_watchdog()
+    start_job_workers()
+    scheduler.load()
+    scheduler.start()
+    if API_SOCKET:
+        serve_unix_socket(API_SOCKET)
+    # Run the Flask app; threaded so checked-out sessions work in parallel
+    app.run(host='0.0.0.0', port=9000, threaded=True)
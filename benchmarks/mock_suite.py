@@ -0,0 +1,152 @@
+"""Latency and throughput benchmarks against the local mock Smarteefi app.
+
+Reports session startup time, p50/p95/p99 toggle latency through the
+Selenium transport and through the browserless HTTP transport, and
+requests/second through the Flask API. Results can be saved and compared
+with an earlier run:
+
+    python benchmarks/mock_suite.py --json before.json
+    python benchmarks/mock_suite.py --compare before.json
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_smarteefi.server import start_in_thread  # noqa: E402
+from pool_throughput import run_burst, wait_until_ready  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values),
+    }
+
+
+def bench_startup(api, runs):
+    times = []
+    for _ in range(runs):
+        start = time.monotonic()
+        session = api.create_session(0)
+        times.append(time.monotonic() - start)
+        api.retire_session(session)
+    return summarize(times)
+
+
+def bench_toggle(api, transport, count):
+    session = transport.open_session(0)
+    try:
+        times = []
+        failures = 0
+        for i in range(count):
+            state = "on" if i % 2 == 0 else "off"
+            start = time.monotonic()
+            success, _ = transport.set_switch(session, "Nikoo", "Switch-1", "ion-tg-5", state, api.Deadline())
+            times.append(time.monotonic() - start)
+            failures += 0 if success else 1
+    finally:
+        transport.close_session(session)
+    result = summarize(times)
+    result["failed"] = failures
+    return result
+
+
+def bench_api(base_url, pool_size, total, concurrency, startup_timeout):
+    env = dict(os.environ, SMARTEEFI_BASE_URL=base_url, SMARTEEFI_POOL_SIZE=str(pool_size))
+    process = subprocess.Popen([sys.executable, "api.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(process, startup_timeout)
+        elapsed, failures = run_burst(total, concurrency)
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait()
+    return {"requests_per_second": total / elapsed, "failed": failures}
+
+
+def print_report(results, baseline=None):
+    def line(name, value, unit):
+        text = f"  {name:<22} {value:>9.3f} {unit}"
+        if baseline is not None:
+            section, key = name.split(".", 1)
+            old = baseline.get(section, {}).get(key)
+            if old:
+                text += f"  ({(value - old) / old * 100:+.1f}% vs baseline)"
+        print(text)
+
+    for key in ("p50", "p95", "p99", "mean"):
+        line(f"startup.{key}", results["startup"][key], "s")
+    for key in ("p50", "p95", "p99", "mean"):
+        line(f"toggle.{key}", results["toggle"][key], "s")
+    print(f"  {'toggle.failed':<22} {results['toggle']['failed']:>9d}")
+    for key in ("p50", "p95", "p99", "mean"):
+        line(f"toggle_http.{key}", results["toggle_http"][key], "s")
+    print(f"  {'toggle_http.failed':<22} {results['toggle_http']['failed']:>9d}")
+    line("api.requests_per_second", results["api"]["requests_per_second"], "req/s")
+    print(f"  {'api.failed':<22} {results['api']['failed']:>9d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--startup-runs", type=int, default=3)
+    parser.add_argument("--toggles", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--step-delay", type=int, default=200)
+    parser.add_argument("--toggle-delay", type=int, default=300)
+    parser.add_argument("--flaky", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="print changes relative to an earlier --json file")
+    args = parser.parse_args()
+
+    mock = start_in_thread(port=0, step_delay=args.step_delay, toggle_delay=args.toggle_delay,
+                           flaky=args.flaky, seed=args.seed)
+    base_url = f"http://127.0.0.1:{mock.server_address[1]}"
+    os.environ["SMARTEEFI_BASE_URL"] = base_url
+    os.environ.setdefault("SMARTEEFI_EMAIL", "bench@example.com")
+    os.environ.setdefault("SMARTEEFI_PASSWORD", "bench")
+    # The state observer would answer repeated toggles from memory
+    os.environ["SMARTEEFI_WATCH_INTERVAL"] = "0"
+    import api
+    from selenium_transport import SeleniumTransport
+    from transports import HttpTransport
+
+    http_transport = HttpTransport(api.HOMES, lambda home, changes: None, base_url=f"{base_url}/mock-api")
+    results = {
+        "config": vars(args),
+        "startup": bench_startup(api, args.startup_runs),
+        "toggle": bench_toggle(api, SeleniumTransport(api.HOMES), args.toggles),
+        "toggle_http": bench_toggle(api, http_transport, args.toggles),
+        "api": bench_api(base_url, args.pool_size, args.requests, args.concurrency, 300),
+    }
+    mock.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
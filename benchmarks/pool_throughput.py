@@ -0,0 +1,102 @@
+"""Measure API throughput for different driver pool sizes.
+
+For each pool size the API is started with SMARTEEFI_POOL_SIZE set, a burst of
+toggle commands spread over the light, fan and charger routes is fired from
+concurrent clients, and the achieved requests/second is printed.
+
+The API runs against a local mock_smarteefi server unless --live is given;
+--live toggles the real light, fan and charger on the Smarteefi site.
+
+    python benchmarks/pool_throughput.py --sizes 1 2 3 --requests 30
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_smarteefi.server import start_in_thread  # noqa: E402
+
+BASE_URL = "http://127.0.0.1:9000"
+ROUTES = ["/lighton", "/fanon", "/chargeron", "/lightoff", "/fanoff", "/chargeroff"]
+
+
+def wait_until_ready(process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("API exited before it became ready.")
+        try:
+            urllib.request.urlopen(BASE_URL + "/", timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    raise RuntimeError("API did not become ready in time.")
+
+
+def post(route):
+    start = time.perf_counter()
+    request = urllib.request.Request(BASE_URL + route, method="POST")
+    try:
+        urllib.request.urlopen(request, timeout=120).read()
+        ok = True
+    except urllib.error.HTTPError:
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def run_burst(total, concurrency):
+    routes = [ROUTES[i % len(ROUTES)] for i in range(total)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, routes))
+    elapsed = time.perf_counter() - start
+    failures = sum(1 for ok, _ in results if not ok)
+    return elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--live", action="store_true",
+                        help="run against the real Smarteefi site and switches instead of the local mock")
+    args = parser.parse_args()
+
+    base_env = dict(os.environ)
+    mock = None
+    if not args.live:
+        mock = start_in_thread(port=0)
+        mock_url = f"http://127.0.0.1:{mock.server_address[1]}"
+        base_env.update(SMARTEEFI_BASE_URL=mock_url, SMARTEEFI_HTTP_API=f"{mock_url}/mock-api")
+        base_env.setdefault("SMARTEEFI_EMAIL", "bench@example.com")
+        base_env.setdefault("SMARTEEFI_PASSWORD", "bench")
+
+    print(f"{'pool size':>9}  {'seconds':>8}  {'req/s':>7}  {'failed':>6}")
+    for size in args.sizes:
+        env = dict(base_env, SMARTEEFI_POOL_SIZE=str(size))
+        process = subprocess.Popen([sys.executable, "api.py"], cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_ready(process, args.startup_timeout)
+            elapsed, failures = run_burst(args.requests, args.concurrency)
+            print(f"{size:>9}  {elapsed:>8.2f}  {args.requests / elapsed:>7.2f}  {failures:>6}")
+        finally:
+            # SIGINT lets the API quit its Chrome sessions on the way out
+            process.send_signal(signal.SIGINT)
+            process.wait()
+    if mock is not None:
+        mock.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Measure session startup time on the cold and warm paths.
+
+Cold: a throwaway Chrome profile, so the full login flow runs.
+Warm: the same profile opened again, so the saved Firebase login is reused.
+Also reports each session's page load time and memory (RSS); pass --lean to
+measure the headless, resource-blocking profile instead of the full one.
+
+    python benchmarks/startup_time.py --runs 3 --lean
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api  # noqa: E402
+
+
+def timed_session():
+    start = time.monotonic()
+    driver = api.create_session(0)
+    elapsed = time.monotonic() - start
+    rss = dict(api.session_rss()).get(driver)
+    page_load = api.session_page_load.get(0)
+    api.retire_session(driver)
+    return elapsed, rss, page_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--lean", action="store_true", help="use the lean headless browser profile")
+    args = parser.parse_args()
+    api.transport.lean = args.lean
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        profile_root = tempfile.mkdtemp(prefix="smarteefi-profile-")
+        api.transport.profile_dir = profile_root
+        try:
+            cold.append(timed_session())
+            warm.append(timed_session())
+        finally:
+            shutil.rmtree(profile_root, ignore_errors=True)
+
+    print(f"{'path':>5}  {'min':>6}  {'mean':>6}  {'max':>6}  {'rss MB':>7}  {'load ms':>7}")
+    for name, runs in (("cold", cold), ("warm", warm)):
+        times = [elapsed for elapsed, _, _ in runs]
+        rss = [value for _, value, _ in runs if value is not None]
+        loads = [value for _, _, value in runs if value is not None]
+        rss_text = f"{sum(rss) / len(rss) / 2**20:>7.0f}" if rss else f"{'n/a':>7}"
+        load_text = f"{sum(loads) / len(loads):>7.0f}" if loads else f"{'n/a':>7}"
+        print(f"{name:>5}  {min(times):>6.1f}  {sum(times) / len(times):>6.1f}  {max(times):>6.1f}  "
+              f"{rss_text}  {load_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Append-only binary log of switch state changes.
+
+Each change is one fixed-size little-endian record: timestamp (float64 epoch
+seconds), device id (uint16), new state (uint8, 1 = on), source (uint8) and
+latency (float32 seconds, NaN when unknown). Device ids map to "home/label"
+names in a small JSON file next to the log.
+
+Callers only put events on a queue; a writer thread appends them in batches,
+so logging never blocks a toggle. Timestamps are kept non-decreasing on
+write, which lets readers memory-map the file and binary-search a time range
+instead of scanning it. Every CHECKPOINT_EVERY records the writer also saves
+each device's state so far to a small JSON file, so finding the state at the
+start of a range reads at most one checkpoint interval of records.
+"""
+import bisect
+import json
+import math
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+EVENT_LOG_FILE = os.getenv("SMARTEEFI_EVENT_LOG", "switch_events.bin")
+QUEUE_SIZE = 10000  # Events waiting for the writer before new ones are dropped
+WRITE_BATCH = 500
+CHECKPOINT_EVERY = 65536  # Records between per-device state checkpoints
+
+RECORD = struct.Struct("<dHBBf")
+STATE_FIELDS = struct.Struct("<dHB5x")  # Just timestamp, device and state, for on-time scans
+SOURCES = ("command", "observed", "scheduled")
+
+
+class EventLog:
+    def __init__(self, path=EVENT_LOG_FILE):
+        self.path = path
+        self.index_path = path + ".devices.json"
+        self.checkpoint_path = path + ".checkpoints.json"
+        self.checkpoints = []  # (record count, {device id: state}) after that many records
+        self.states = {}  # Device id -> latest state written, for the next checkpoint
+        self.written = 0
+        self.devices = []  # Device id -> "home/label"
+        self.device_ids = {}
+        self.pending = queue.Queue(maxsize=QUEUE_SIZE)
+        self.last_ts = 0.0
+        self.dropped = 0
+
+    def open(self):
+        """Load the device index, drop a torn trailing record and start the writer."""
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.devices = json.load(f)
+            self.device_ids = {name: device_id for device_id, name in enumerate(self.devices)}
+        if os.path.exists(self.path):
+            size = os.path.getsize(self.path)
+            if size % RECORD.size:
+                with open(self.path, "r+b") as f:
+                    f.truncate(size - size % RECORD.size)
+                size -= size % RECORD.size
+            if size:
+                with open(self.path, "rb") as f:
+                    f.seek(size - RECORD.size)
+                    self.last_ts = RECORD.unpack(f.read(RECORD.size))[0]
+        self._load_checkpoints()
+        threading.Thread(target=self._write_loop, name="event-log", daemon=True).start()
+        print(f"Event log at {self.path} with {len(self.devices)} device(s).")
+
+    def append(self, timestamp, home, switch_label, state, source, latency=None):
+        try:
+            self.pending.put_nowait((timestamp, f"{home}/{switch_label}", state, source, latency))
+        except queue.Full:
+            self.dropped += 1
+
+    def _load_checkpoints(self):
+        count = os.path.getsize(self.path) // RECORD.size if os.path.exists(self.path) else 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                self.checkpoints = [(index, {int(device_id): state for device_id, state in states.items()})
+                                    for index, states in json.load(f) if index <= count]
+        # Replay records after the last checkpoint (all of them for a log
+        # written before checkpoints existed), adding any checkpoints missed
+        index, states = self.checkpoints[-1] if self.checkpoints else (0, {})
+        self.states = dict(states)
+        self.written = index
+        added = False
+        with self._mapped() as (mm, count):
+            for chunk_start in range(index, count, CHECKPOINT_EVERY):
+                chunk_end = min(count, chunk_start + CHECKPOINT_EVERY)
+                for _, device_id, state, _, _ in RECORD.iter_unpack(mm[chunk_start * RECORD.size:chunk_end * RECORD.size]):
+                    added = self._track(device_id, state) or added
+        if added:
+            self._save_checkpoints()
+
+    def _track(self, device_id, state):
+        # Returns True when this record completed a checkpoint interval
+        self.states[device_id] = state
+        self.written += 1
+        if self.written % CHECKPOINT_EVERY:
+            return False
+        self.checkpoints.append((self.written, dict(self.states)))
+        return True
+
+    def _save_checkpoints(self):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([[index, states] for index, states in self.checkpoints], f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _device_id(self, name):
+        # Only called from the writer thread
+        device_id = self.device_ids.get(name)
+        if device_id is None:
+            device_id = self.device_ids[name] = len(self.devices)
+            self.devices.append(name)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.devices, f)
+            os.replace(tmp_path, self.index_path)
+        return device_id
+
+    def _write_loop(self):
+        with open(self.path, "ab") as f:
+            while True:
+                batch = [self.pending.get()]
+                while len(batch) < WRITE_BATCH:
+                    try:
+                        batch.append(self.pending.get_nowait())
+                    except queue.Empty:
+                        break
+                data = bytearray()
+                checkpointed = False
+                for timestamp, name, state, source, latency in batch:
+                    # Events from different threads can arrive slightly out of order
+                    self.last_ts = max(timestamp, self.last_ts)
+                    device_id = self._device_id(name)
+                    state = 1 if state == "on" else 0
+                    data += RECORD.pack(self.last_ts, device_id, state,
+                                        SOURCES.index(source), math.nan if latency is None else latency)
+                    checkpointed = self._track(device_id, state) or checkpointed
+                f.write(data)
+                f.flush()
+                if checkpointed:
+                    # Only once the records it covers are on disk
+                    self._save_checkpoints()
+
+    @contextmanager
+    def _mapped(self):
+        """Yield (buffer, record count) over the complete records currently in the file."""
+        count = os.path.getsize(self.path) // RECORD.size if os.path.exists(self.path) else 0
+        if not count:
+            yield b"", 0
+            return
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), count * RECORD.size, access=mmap.ACCESS_READ)
+            try:
+                yield mm, count
+            finally:
+                mm.close()
+
+    def _bisect(self, mm, count, timestamp):
+        # Index of the first record at or after timestamp
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(mm, mid * RECORD.size)[0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, since, until, device=None, limit=1000):
+        """Return up to limit events in [since, until), oldest first, optionally for one "home/label"."""
+        device_id = None
+        if device is not None:
+            device_id = self.device_ids.get(device)
+            if device_id is None:
+                return []
+        events = []
+        with self._mapped() as (mm, count):
+            start = self._bisect(mm, count, since)
+            end = self._bisect(mm, count, until)
+            for offset in range(start * RECORD.size, end * RECORD.size, RECORD.size):
+                if len(events) >= limit:
+                    break
+                timestamp, event_device, state, source, latency = RECORD.unpack_from(mm, offset)
+                if device_id is not None and event_device != device_id:
+                    continue
+                events.append({
+                    "ts": timestamp,
+                    "device": self.devices[event_device],
+                    "state": "on" if state else "off",
+                    "source": SOURCES[source],
+                    "latency": None if math.isnan(latency) else round(latency, 4),
+                })
+        return events
+
+    def on_durations(self, since, until):
+        """Return {"home/label": {"YYYY-MM-DD": seconds on}} for [since, until), split on local days."""
+        until = min(until, time.time())
+        totals = {}
+        day = []  # Bounds and key of the last local day touched, reused across intervals
+        with self._mapped() as (mm, count):
+            start = self._bisect(mm, count, since)
+            end = self._bisect(mm, count, until)
+            # Each device's state at `since`: the last checkpoint before it,
+            # plus the records between that checkpoint and `since`
+            checkpoints = self.checkpoints
+            position = bisect.bisect_right([index for index, _ in checkpoints], start)
+            index, states = checkpoints[position - 1] if position else (0, {})
+            states = dict(states)
+            for _, device_id, state, _, _ in RECORD.iter_unpack(mm[index * RECORD.size:start * RECORD.size]):
+                states[device_id] = state
+            on_since = {device_id: since for device_id, state in states.items() if state}  # Clamped to since
+            for timestamp, device_id, state in STATE_FIELDS.iter_unpack(mm[start * RECORD.size:end * RECORD.size]):
+                if state:
+                    on_since.setdefault(device_id, timestamp)
+                elif device_id in on_since:
+                    add_on_time(totals, self.devices[device_id], on_since.pop(device_id), timestamp, day)
+        for device_id, turned_on in on_since.items():
+            add_on_time(totals, self.devices[device_id], turned_on, until, day)
+        return {name: {key: round(seconds, 3) for key, seconds in days.items()} for name, days in totals.items()}
+
+
+def add_on_time(totals, name, start, end, day):
+    # day caches [midnight, next midnight, "YYYY-MM-DD"] of the last day used
+    days = totals.setdefault(name, {})
+    while start < end:
+        if not day or not day[0] <= start < day[1]:
+            date = datetime.fromtimestamp(start).date()
+            day[:] = [datetime.combine(date, datetime.min.time()).timestamp(),
+                      datetime.combine(date + timedelta(days=1), datetime.min.time()).timestamp(),
+                      date.isoformat()]
+        piece_end = min(end, day[1])
+        days[day[2]] = days.get(day[2], 0.0) + piece_end - start
+        start = piece_end
@@ -1,199 +1,243 @@
+"""Command-line control for the Smarteefi switches.
+
+Commands go to the running API (api.py) over HTTP, or over the Unix socket
+in SMARTEEFI_API_SOCKET, so a toggle reuses the API's logged-in sessions and
+returns in milliseconds. With --standalone, or when the API cannot be
+reached, main.py launches and logs in its own browser instead.
+
+    python main.py light on
+    python main.py --home Home geyser off
+    python main.py scene alloff
+    python main.py state
+    python main.py               # interactive
+"""
+import argparse
+import http.client
+import json
 import os
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import (
-    NoSuchElementException,
-    TimeoutException,
-    ElementClickInterceptedException,
-)
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import time
+import socket
 import sys
-from dotenv import load_dotenv
+import time
+from urllib.parse import quote, urlsplit
 
-load_dotenv('environment_keys.env')
+from smarteefi import API_SOCKET, API_URL, DEVICES_FILE, PROFILE_DIR, load_device_config
 
-LOGIN_URL = "https://smarteefi.web.app/login"
-EMAIL = os.getenv("SMARTEEFI_EMAIL")
-PASSWORD = os.getenv("SMARTEEFI_PASSWORD")
+API_TIMEOUT = 90  # Longer than the API's own per-command deadline
 
-if not EMAIL or not PASSWORD:
-    print("Error: SMARTEEFI_EMAIL and SMARTEEFI_PASSWORD must be set in environment_keys.env")
-    sys.exit(1)
 
-def init_driver():
-    chrome_options = Options()
-    chrome_options.add_argument("--start-maximized")
-    driver = webdriver.Chrome(options=chrome_options)
-    return driver
+class ApiUnavailable(Exception):
+    pass
 
-def perform_login(driver):
-    try:
-        driver.get(LOGIN_URL)
-        wait = WebDriverWait(driver, 60)
-        email_input = wait.until(
-            EC.element_to_be_clickable((By.XPATH, "//input[@placeholder='Enter your email']"))
-        )
-        email_input.clear()
-        email_input.send_keys(EMAIL)
-        print("Entered email.")
-        login_button = driver.find_element(By.XPATH, "//ion-button[contains(., 'Login/Signup')]")
-        login_button.click()
-        print("Clicked Login/Signup button.")
-        wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Enter your password']")))
-        print("Password page loaded.")
-        password_input = driver.find_element(By.XPATH, "//input[@placeholder='Enter your password']")
-        password_input.clear()
-        password_input.send_keys(PASSWORD)
-        print("Entered password.")
-        submit_button = driver.find_element(By.XPATH, "//ion-button[contains(., 'Login') and not(contains(., 'Signup'))]")
-        submit_button.click()
-        print("Clicked Login button.")
-        wait.until(EC.presence_of_element_located((By.XPATH, "//ion-tab-bar")))
-        print("Login successful.")
-        time.sleep(10)
-    except TimeoutException:
-        print("Login failed: Timeout while trying to log in.")
-        driver.quit()
-        sys.exit()
-    except NoSuchElementException as e:
-        print(f"Login failed: Element not found. {e}")
-        driver.quit()
-        sys.exit()
-    except Exception as e:
-        print(f"An unexpected error occurred during login: {e}")
-        driver.quit()
-        sys.exit()
 
-def select_nikoo_home(driver):
-    try:
-        wait = WebDriverWait(driver, 60)
-        dropdown = wait.until(EC.element_to_be_clickable((By.XPATH, "//ion-select")))
-        dropdown.click()
-        print("Clicked Home dropdown.")
-        alert_xpath = "//div[contains(@class, 'alert-wrapper') and contains(@class, 'ion-overlay-wrapper')]"
-        wait.until(EC.visibility_of_element_located((By.XPATH, alert_xpath)))
-        print("Alert popup appeared.")
-        nikoo_button_xpath = "//div[contains(@class, 'alert-wrapper')]//div[@class='alert-radio-label sc-ion-alert-md' and text()='Nikoo ']/ancestor::button"
-        nikoo_buttons = driver.find_elements(By.XPATH, nikoo_button_xpath)
-        print(f"Number of 'Nikoo' buttons found: {len(nikoo_buttons)}")
-        if not nikoo_buttons:
-            print("No 'Nikoo' button found.")
-            return
-        nikoo_button = nikoo_buttons[0]
-        nikoo_button.click()
-        print("Selected 'Nikoo' option.")
-        okay_button_xpath = "//div[contains(@class, 'alert-wrapper')]//button/span[text()='Okay']"
-        okay_buttons = driver.find_elements(By.XPATH, okay_button_xpath)
-        print(f"Number of 'Okay' buttons found: {len(okay_buttons)}")
-        if not okay_buttons:
-            print("No 'Okay' button found.")
-            return
-        okay_button = okay_buttons[0]
-        okay_button.click()
-        print("Clicked 'Okay' button.")
-        wait.until(EC.invisibility_of_element_located((By.XPATH, alert_xpath)))
-        print("'Nikoo' selection confirmed.")
-    except TimeoutException:
-        print("Failed to select 'Nikoo': Timeout while waiting for elements.")
-        driver.quit()
-        sys.exit()
-    except NoSuchElementException as e:
-        print(f"Failed to select 'Nikoo': Element not found. {e}")
-        driver.quit()
-        sys.exit()
-    except Exception as e:
-        print(f"An unexpected error occurred while selecting 'Nikoo': {e}")
-        driver.quit()
-        sys.exit()
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
 
-def toggle_switch(driver, switch_label, hidden_input_name):
-    try:
-        wait = WebDriverWait(driver, 60)
-        ion_toggle_xpath = f"//ion-item[ion-label/h2[contains(text(), '{switch_label}')]]//ion-toggle"
-        ion_toggle_elements = driver.find_elements(By.XPATH, ion_toggle_xpath)
-        print(f"Number of ion-toggle elements found for '{switch_label}': {len(ion_toggle_elements)}")
-        if not ion_toggle_elements:
-            print(f"No ion-toggle element found for '{switch_label}'.")
-            return
-        ion_toggle = ion_toggle_elements[0]
-        if ion_toggle.is_displayed() and ion_toggle.is_enabled():
-            print("Toggle is visible and enabled.")
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ApiClient:
+    """Sends commands to the running API."""
+
+    def request(self, method, path):
+        if API_SOCKET:
+            connection = UnixHTTPConnection(API_SOCKET, API_TIMEOUT)
         else:
-            print("Toggle is either not visible or not enabled.")
+            url = urlsplit(API_URL)
+            connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            connection = connection_class(url.netloc, timeout=API_TIMEOUT)
+            path = url.path + path
+        try:
+            try:
+                connection.connect()
+            except OSError as e:
+                # Only a failed connect falls back; a sent command may already have run
+                raise ApiUnavailable(f"API not reachable at {API_SOCKET or API_URL}: {e}")
+            try:
+                connection.request(method, path)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                # e.g. a timeout or a dropped connection once the command was sent
+                return False, {"message": f"No response from the API at {API_SOCKET or API_URL}: {e}"}
+        finally:
+            connection.close()
+        try:
+            body = json.loads(data or b"{}")
+        except ValueError:
+            # e.g. an HTML error page from Flask or a proxy
+            return False, {"message": f"API returned HTTP {response.status} {response.reason} without a JSON body."}
+        return response.status < 400, body
+
+    def check(self):
+        self.request("GET", "/")
+
+    def toggle(self, home, name, state):
+        ok, body = self.request("POST", f"/homes/{quote(home)}/devices/{quote(name)}/{state}")
+        return ok, body.get("message", "")
+
+    def scene(self, home, name):
+        ok, body = self.request("POST", f"/homes/{quote(home)}/scenes/{quote(name)}")
+        return ok, body.get("results") or body.get("message", "")
+
+    def state(self, home):
+        ok, body = self.request("GET", f"/homes/{quote(home)}/state")
+        return ok, body.get("switches") or body.get("message", "")
+
+    def close(self):
+        pass
+
+
+class BrowserClient:
+    """Drives a browser of its own, for when the API is not running."""
+
+    def __init__(self, home, homes):
+        # Selenium and the browser code are only loaded on this path; the API
+        # module (Flask, the session pool) is never imported
+        import selenium_transport
+        from smarteefi import init_driver, perform_login, resume_session, select_home
+
+        self.browser = selenium_transport
+        self.home = home
+        self.homes = homes
+        start = time.monotonic()
+        # Separate from the API's session-N profiles so both can run at once
+        profile_dir = os.path.join(os.path.abspath(PROFILE_DIR), "cli") if PROFILE_DIR else None
+        self.driver = init_driver(profile_dir)
+        try:
+            warm = profile_dir is not None and resume_session(self.driver)
+            if not warm:
+                perform_login(self.driver)
+            select_home(self.driver, home)
+        except Exception:
+            self.driver.quit()
+            raise
+        print(f"Ready in {time.monotonic() - start:.1f}s ({'warm' if warm else 'cold'} start).")
+
+    def check_home(self, home):
+        if home != self.home:
+            raise ValueError(f"Standalone mode is set up for '{self.home}', not '{home}'.")
+
+    def toggle(self, home, name, state):
+        self.check_home(home)
+        device = self.homes[home]["devices"][name]
+        return self.browser.toggle_switch(self.driver, device["label"], device["input"], state, home=home)
+
+    def scene(self, home, name):
+        self.check_home(home)
+        results = self.browser.apply_switch_states(self.driver, self.homes[home]["scenes"][name], home=home)
+        return (all(ok for ok, _ in results.values()),
+                {label: {"success": ok, "message": message} for label, (ok, message) in results.items()})
+
+    def state(self, home):
+        self.check_home(home)
+        return True, self.browser.read_switch_states(self.driver)
+
+    def close(self):
+        self.driver.quit()
+
+
+def connect(home, homes, standalone):
+    if not standalone:
+        client = ApiClient()
+        try:
+            client.check()
+            return client
+        except ApiUnavailable as e:
+            print(f"{e}. Falling back to a standalone browser.")
+    return BrowserClient(home, homes)
+
+
+def command_error(devices, scenes, command):
+    """Return why command (a list of words) cannot run, or None if it is valid."""
+    if command == ["state"]:
+        return None
+    if len(command) == 2 and command[0] == "scene":
+        if command[1] not in scenes:
+            return f"Unknown scene '{command[1]}'. Choose from: {', '.join(scenes)}"
+        return None
+    if len(command) == 2 and command[0] in devices and command[1] in ("on", "off"):
+        return None
+    return f"Usage: <device> on|off, scene <name>, or state. Devices: {', '.join(devices)}"
+
+
+def run_command(client, home, devices, scenes, command):
+    """Run one command (a list of words) and return True if it succeeded."""
+    error = command_error(devices, scenes, command)
+    if error:
+        print(error)
+        return False
+    if command == ["state"]:
+        ok, result = client.state(home)
+    elif command[0] == "scene":
+        ok, result = client.scene(home, command[1])
+    else:
+        ok, result = client.toggle(home, command[0], command[1])
+    print(json.dumps(result, indent=2) if isinstance(result, dict) else result)
+    return ok
+
+
+def interactive(client, home, devices, scenes):
+    names = ", ".join(f"'{name}'" for name in devices)
+    while True:
+        switch = input(f"Which switch do you want to toggle? (Enter {names}, or 'exit' to quit): ").strip().lower()
+        if switch == "exit":
+            print("Exiting the script.")
             return
-        js = f"""
-            var elem = document.querySelector('input[name="{hidden_input_name}"]');
-            return elem ? elem.value : null;
-        """
-        current_value = driver.execute_script(js)
-        is_on = current_value == "on"
-        print(f"The {switch_label} is currently {'ON' if is_on else 'OFF'}.")
+        if switch not in devices:
+            print(f"Invalid input. Please enter {names}, or 'exit'.")
+            continue
         while True:
-            user_input = input(f"Do you want to turn the {switch_label} ON or OFF? (Enter 'on' or 'off'): ").strip().lower()
-            if user_input in ["on", "off"]:
+            state = input(f"Do you want to turn the {switch} ON or OFF? (Enter 'on' or 'off'): ").strip().lower()
+            if state in ("on", "off"):
                 break
-            else:
-                print("Invalid input. Please enter 'on' or 'off'.")
-        desired_state = user_input == "on"
-        if desired_state != is_on:
-            try:
-                driver.execute_script("arguments[0].click();", ion_toggle)
-                print(f"Clicked the toggle to turn the {switch_label} {'ON' if desired_state else 'OFF'}.")
-                time.sleep(2)
-                new_value = driver.execute_script(js)
-                new_state = new_value == "on"
-                if new_state == desired_state:
-                    print(f"Successfully set the {switch_label} to {'ON' if desired_state else 'OFF'}.")
-                else:
-                    print(f"Failed to set the {switch_label} to {'ON' if desired_state else 'OFF'}.")
-            except ElementClickInterceptedException:
-                print("Unable to click the toggle. It might be covered by another element.")
-                time.sleep(5)
-                try:
-                    driver.execute_script("arguments[0].click();", ion_toggle)
-                    print(f"Successfully clicked the toggle after waiting. {switch_label} has been turned {'ON' if desired_state else 'OFF'}.")
-                    time.sleep(2)
-                    new_value = driver.execute_script(js)
-                    new_state = new_value == "on"
-                    if new_state == desired_state:
-                        print(f"Successfully set the {switch_label} to {'ON' if desired_state else 'OFF'}.")
-                    else:
-                        print(f"Failed to set the {switch_label} to {'ON' if desired_state else 'OFF'}.")
-                except Exception as e:
-                    print(f"Still unable to click the toggle: {e}")
-            except Exception as e:
-                print(f"An error occurred while toggling the {switch_label}: {e}")
-        else:
-            print(f"{switch_label.capitalize()} is already {'ON' if is_on else 'OFF'}.")
-    except TimeoutException:
-        print("The toggle element was not found within the given time.")
-    except NoSuchElementException as e:
-        print(f"Toggle element not found: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred while toggling the {switch_label}: {e}")
+            print("Invalid input. Please enter 'on' or 'off'.")
+        run_command(client, home, devices, scenes, [switch, state])
+
 
 def main():
-    driver = init_driver()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--home", help="home to control (default: default_home from the device config)")
+    parser.add_argument("--standalone", action="store_true",
+                        help="drive a browser directly instead of using the running API")
+    parser.add_argument("command", nargs="*", help="<device> on|off, scene <name>, or state")
+    args = parser.parse_args()
+
     try:
-        perform_login(driver)
-        select_nikoo_home(driver)
-        while True:
-            switch = input("Which switch do you want to toggle? (Enter 'light', 'charger', or 'exit' to quit): ").strip().lower()
-            if switch == 'light':
-                toggle_switch(driver, 'Switch-1', 'ion-tg-5')
-            elif switch == 'charger':
-                toggle_switch(driver, 'Switch-2', 'ion-tg-6')
-            elif switch == 'exit':
-                print("Exiting the script.")
-                break
-            else:
-                print("Invalid input. Please enter 'light', 'charger', or 'exit'.")
+        homes, default_home = load_device_config(DEVICES_FILE)
+    except (OSError, ValueError) as e:
+        print(f"Error: could not load device config {DEVICES_FILE}: {e}")
+        sys.exit(1)
+    home = args.home or default_home
+    if home not in homes:
+        print(f"Unknown home '{home}'. Choose from: {', '.join(homes)}")
+        sys.exit(1)
+    devices = homes[home]["devices"]
+    scenes = homes[home]["scenes"]
+    command = [word.lower() for word in args.command]
+    # Check the command before the API is contacted or a browser is started
+    error = command_error(devices, scenes, command) if command else None
+    if error:
+        print(error)
+        sys.exit(1)
+
+    try:
+        client = connect(home, homes, args.standalone)
+    except Exception as e:
+        print(f"Could not start a browser session: {e}")
+        sys.exit(1)
+    try:
+        if command:
+            ok = run_command(client, home, devices, scenes, command)
+            sys.exit(0 if ok else 1)
+        interactive(client, home, devices, scenes)
     finally:
-        time.sleep(5)
-        driver.quit()
+        client.close()
+
 
 if __name__ == "__main__":
     main()
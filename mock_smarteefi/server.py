@@ -0,0 +1,226 @@
+"""Local stand-in for smarteefi.web.app.
+
+Serves a static page that reproduces the markup the scripts drive (login
+pages, the ion-select home alert, ion-backdrop overlays and ion-item /
+ion-toggle rows with hidden ion-tg-N inputs) plus a small JSON backend that
+holds switch state, so every browser session sees the same devices. The
+backend also takes a token login (POST /mock-api/login) for the browserless
+HTTP transport.
+
+    python mock_smarteefi/server.py --port 8100 --step-delay 300 --flaky 0.05
+    SMARTEEFI_BASE_URL=http://127.0.0.1:8100 python api.py
+    SMARTEEFI_TRANSPORT=http SMARTEEFI_HTTP_API=http://127.0.0.1:8100/mock-api python api.py
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.html")
+
+# Home name -> list of [label, hidden input name, value]
+DEFAULT_HOMES = {
+    "Home": [
+        ["Light-1", "ion-tg-0", ""],
+        ["Light-2", "ion-tg-1", ""],
+        ["Geyser", "ion-tg-2", ""],
+    ],
+    "Nikoo": [
+        ["Switch-1", "ion-tg-5", ""],
+        ["Switch-2", "ion-tg-6", ""],
+        ["Switch-3", "ion-tg-7", ""],
+        ["Switch-4", "ion-tg-8", ""],
+        ["Fan-1", "ion-tg-9", ""],
+    ],
+}
+
+
+class MockState:
+    def __init__(self, toggle_delay, flaky, seed=None):
+        self.toggle_delay = toggle_delay
+        self.flaky = flaky
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.homes = json.loads(json.dumps(DEFAULT_HOMES))
+            self.version = 0
+            self.toggles = 0
+            self.dropped = 0
+            self.tokens = set()
+
+    def login(self, email, password):
+        """Return a new bearer token; any non-empty credentials are accepted."""
+        if not email or not password:
+            return None
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        return token
+
+    def authorized(self, header):
+        # The page sends no token; API clients that send one must send a valid one
+        if not header:
+            return True
+        with self.lock:
+            return header.startswith("Bearer ") and header[len("Bearer "):] in self.tokens
+
+    def snapshot(self, home):
+        with self.lock:
+            devices = [{"label": label, "input": name, "value": value}
+                       for label, name, value in self.homes.get(home, [])]
+            return {"home": home, "version": self.version, "devices": devices}
+
+    def request_toggle(self, home, label, value):
+        """Apply a switch command after the simulated cloud delay; may drop it."""
+        with self.lock:
+            self.toggles += 1
+            if self.random.random() < self.flaky:
+                self.dropped += 1
+                return False
+        timer = threading.Timer(self.toggle_delay / 1000.0, self._apply, (home, label, value))
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def _apply(self, home, label, value):
+        with self.lock:
+            for device in self.homes.get(home, []):
+                if device[0] == label:
+                    device[2] = value
+                    self.version += 1
+
+    def stats(self):
+        with self.lock:
+            return {"toggles": self.toggles, "dropped": self.dropped, "version": self.version}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the HTTP transport can reuse one connection per session
+    protocol_version = "HTTP/1.1"
+    state = None
+    page_config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # A client (e.g. an API process shutting down) dropped its keep-alive connection
+            pass
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/mock-api/") and not self.state.authorized(self.headers.get("Authorization")):
+            self.send_json({"error": "invalid token"}, 401)
+        elif url.path == "/mock-api/state":
+            home = parse_qs(url.query).get("home", ["Home"])[0]
+            self.send_json(self.state.snapshot(home))
+        elif url.path == "/mock-api/stats":
+            self.send_json(self.state.stats())
+        elif url.path.startswith("/mock-api/"):
+            self.send_json({"error": "not found"}, 404)
+        else:
+            # Single page app: every other path gets the page
+            with open(INDEX_PATH) as f:
+                page = f.read().replace("/*MOCK_CONFIG*/{}", json.dumps(self.page_config))
+            data = page.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/mock-api/login":
+            body = self.read_json()
+            token = self.state.login(body.get("email"), body.get("password"))
+            if token is None:
+                self.send_json({"error": "email and password are required"}, 400)
+            else:
+                self.send_json({"idToken": token, "expiresIn": "3600"})
+        elif not self.state.authorized(self.headers.get("Authorization")):
+            self.read_json()
+            self.send_json({"error": "invalid token"}, 401)
+        elif url.path == "/mock-api/toggle":
+            body = self.read_json()
+            accepted = self.state.request_toggle(body["home"], body["label"], body["value"])
+            self.send_json({"accepted": accepted}, 202)
+        elif url.path == "/mock-api/reset":
+            self.state.reset()
+            self.send_json({"reset": True})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+
+def make_server(host="127.0.0.1", port=8100, step_delay=200, toggle_delay=300,
+                poll_interval=250, flaky=0.0, seed=None):
+    handler = type("Handler", (MockHandler,), {
+        "state": MockState(toggle_delay, flaky, seed),
+        "page_config": {
+            "stepDelay": step_delay,
+            "pollInterval": poll_interval,
+            "flaky": flaky,
+        },
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_in_thread(**kwargs):
+    """Start a mock server on a background thread and return it (port 0 picks a free port)."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name="mock-smarteefi", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Smarteefi web app.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--step-delay", type=int, default=200,
+                        help="ms before each page transition, alert or overlay clears")
+    parser.add_argument("--toggle-delay", type=int, default=300,
+                        help="ms the backend takes to apply a switch command")
+    parser.add_argument("--poll-interval", type=int, default=250,
+                        help="ms between page refreshes of switch state")
+    parser.add_argument("--flaky", type=float, default=0.0,
+                        help="fraction of switch commands dropped and of page steps given an extra overlay")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.step_delay, args.toggle_delay,
+                         args.poll_interval, args.flaky, args.seed)
+    print(f"Mock Smarteefi running on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
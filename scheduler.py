@@ -0,0 +1,208 @@
+"""Built-in scheduler for switch commands.
+
+Rules sit in a heap ordered by their next due time and are persisted to a
+JSON file so they survive restarts. Every rule that comes due within
+MERGE_WINDOW seconds of the first one is merged, per home, into a single
+switch -> state map, so co-scheduled actions run as one batch over the page
+instead of one browser round trip each.
+
+A rule is one-shot ("at": epoch seconds or a local ISO date-time) or
+recurring ("every": seconds, or "daily": "HH:MM" local time).
+"""
+import heapq
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+SCHEDULES_FILE = os.getenv("SMARTEEFI_SCHEDULES_FILE", "schedules.json")
+MERGE_WINDOW = float(os.getenv("SMARTEEFI_SCHEDULE_MERGE_WINDOW", "1.0"))  # Seconds co-due rules are merged across
+MISSED_GRACE = float(os.getenv("SMARTEEFI_SCHEDULE_GRACE", "300"))  # One-shots missed while down still run if this recent
+MIN_INTERVAL = 1.0
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+def finite_seconds(value):
+    """Return value as a float, or None if it is not a finite number."""
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except OverflowError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def parse_timing(spec):
+    """Return the timing fields of a rule from a request body, raising ScheduleError if invalid."""
+    kinds = [kind for kind in ("at", "every", "daily") if spec.get(kind) is not None]
+    if len(kinds) != 1:
+        raise ScheduleError("Give exactly one of 'at', 'every' or 'daily'.")
+    kind = kinds[0]
+    value = spec[kind]
+    if kind == "at":
+        if isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value).timestamp()
+            except ValueError:
+                raise ScheduleError(f"Invalid 'at' time '{value}'.")
+        value = finite_seconds(value)
+        if value is None:
+            raise ScheduleError("'at' must be epoch seconds or an ISO date-time.")
+        return {"at": value}
+    if kind == "every":
+        value = finite_seconds(value)
+        if value is None or value < MIN_INTERVAL:
+            raise ScheduleError(f"'every' must be a finite number of seconds >= {MIN_INTERVAL:g}.")
+        return {"every": value}
+    try:
+        hour, minute = (int(part) for part in str(value).split(":"))
+    except ValueError:
+        raise ScheduleError(f"Invalid 'daily' time '{value}', expected HH:MM.")
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ScheduleError(f"Invalid 'daily' time '{value}', expected HH:MM.")
+    return {"daily": f"{hour:02d}:{minute:02d}"}
+
+
+def next_run(rule, after):
+    """Return the first due time of rule strictly after `after` (epoch seconds), or None."""
+    if "at" in rule:
+        return rule["at"] if rule["at"] > after else None
+    if "every" in rule:
+        periods = math.floor((after - rule["created_at"]) / rule["every"]) + 1
+        return rule["created_at"] + max(periods, 1) * rule["every"]
+    hour, minute = (int(part) for part in rule["daily"].split(":"))
+    candidate = datetime.fromtimestamp(after).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate.timestamp() <= after:
+        candidate += timedelta(days=1)
+    return candidate.timestamp()
+
+
+class Scheduler:
+    def __init__(self, execute, path=SCHEDULES_FILE):
+        self.execute = execute  # execute(home, {switch: state}) runs one merged batch
+        self.path = path
+        self.rules = {}  # Rule id -> rule dict
+        self.heap = []  # (due, rule id); entries whose due no longer matches the rule are skipped
+        self.changed = threading.Condition()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            rules = json.load(f)
+        now = time.time()
+        with self.changed:
+            for rule in rules:
+                if "at" in rule:
+                    if rule["at"] < now - MISSED_GRACE:
+                        print(f"Dropping schedule {rule['id']}: missed by more than {MISSED_GRACE:.0f}s.")
+                        continue
+                    due = rule["at"]
+                else:
+                    due = next_run(rule, now)
+                self._push(rule, due)
+            self._save()
+        print(f"Loaded {len(self.rules)} schedule(s) from {self.path}.")
+
+    def _save(self):
+        # Caller must hold self.changed; write then rename so a crash cannot truncate the file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self.rules.values()), f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _push(self, rule, due):
+        # Caller must hold self.changed
+        rule["next_run"] = due
+        self.rules[rule["id"]] = rule
+        heapq.heappush(self.heap, (due, rule["id"]))
+
+    def add(self, home, actions, timing):
+        rule = {"id": uuid.uuid4().hex[:12], "home": home, "actions": dict(actions),
+                "created_at": time.time(), "last_run": None}
+        rule.update(timing)
+        due = next_run(rule, rule["created_at"])
+        if due is None:
+            raise ScheduleError("That time is already in the past.")
+        with self.changed:
+            self._push(rule, due)
+            self._save()
+            self.changed.notify()
+        return dict(rule)
+
+    def remove(self, rule_id):
+        with self.changed:
+            if self.rules.pop(rule_id, None) is None:
+                return False
+            self._save()
+            self.changed.notify()
+        return True
+
+    def list(self):
+        with self.changed:
+            return sorted((dict(rule) for rule in self.rules.values()), key=lambda rule: rule["next_run"])
+
+    def _take_due(self):
+        """Block until rules are due, reschedule them and return them in due order."""
+        with self.changed:
+            while True:
+                while self.heap:
+                    due, rule_id = self.heap[0]
+                    rule = self.rules.get(rule_id)
+                    if rule is not None and rule["next_run"] == due:
+                        break
+                    heapq.heappop(self.heap)  # Removed or rescheduled
+                if not self.heap:
+                    self.changed.wait()
+                    continue
+                delay = self.heap[0][0] - time.time()
+                if delay > 0:
+                    self.changed.wait(delay)
+                    continue
+                break
+            now = time.time()
+            window_end = self.heap[0][0] + MERGE_WINDOW
+            due_rules = []
+            while self.heap and self.heap[0][0] <= window_end:
+                due, rule_id = heapq.heappop(self.heap)
+                rule = self.rules.get(rule_id)
+                if rule is None or rule["next_run"] != due:
+                    continue
+                due_rules.append(dict(rule))
+            # Rescheduled only now so a short "every" rule cannot come due twice in one window
+            for fired in due_rules:
+                rule = self.rules[fired["id"]]
+                rule["last_run"] = now
+                following = next_run(rule, max(fired["next_run"], now))
+                if following is None:
+                    del self.rules[rule["id"]]
+                else:
+                    self._push(rule, following)
+            self._save()
+            return due_rules
+
+    def _run(self):
+        while True:
+            due_rules = self._take_due()
+            # Later rules win when two set the same switch; actions are keyed by switch label
+            merged = {}
+            counts = {}
+            for rule in due_rules:
+                merged.setdefault(rule["home"], {}).update(rule["actions"])
+                counts[rule["home"]] = counts.get(rule["home"], 0) + 1
+            for home, actions in merged.items():
+                print(f"Running {counts[home]} scheduled rule(s) for {home} in one batch: {actions}")
+                try:
+                    self.execute(home, actions)
+                except Exception as e:
+                    print(f"Scheduled batch for {home} failed: {e}")
+
+    def start(self):
+        threading.Thread(target=self._run, name="scheduler", daemon=True).start()
@@ -0,0 +1,571 @@
+"""Selenium backend: drives the Smarteefi web app in Chrome.
+
+Each pool session is a WebDriver with one tab per home, selected once at
+startup. Commands locate the ion-toggle for a switch, click it and wait for
+its hidden ion-tg-N input to change; a MutationObserver in each tab feeds
+switch changes back to the caller's state table.
+
+api.py imports this module only when SMARTEEFI_TRANSPORT is "selenium", and
+main.py only in standalone mode, so neither needs Selenium otherwise.
+"""
+import os
+
+import metrics
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+
+from smarteefi import APP_URL, LEAN, PROFILE_DIR, init_driver, perform_login, resume_session, select_home
+from transports import Transport
+from waits import Deadline, SETUP_TIMEOUT, wait_for_overlays, wait_in_viewport, wait_until
+
+PHASE_SECONDS = metrics.Histogram(
+    "smarteefi_phase_seconds", "Time spent in each browser phase of setup and toggling.", ["phase"])
+
+
+def phase(name):
+    return metrics.timed(PHASE_SECONDS, name, phase=name)
+
+
+# Cached ion-toggle WebElements per session tab: (driver, home) -> {label: element}.
+# Built once per tab and rebuilt only when a handle goes stale.
+toggle_handles = {}
+
+# Each session keeps one tab per home, selected once at startup, so changing
+# homes is a switch_to.window rather than the home selector alert.
+home_windows = {}  # Driver -> {home: window handle}
+current_home = {}  # Driver -> home whose tab is active
+
+# Every ion-item toggle on the page as [label, hidden input name, ion-toggle]
+INDEX_TOGGLES_JS = """
+    var index = [];
+    document.querySelectorAll('ion-item').forEach(function (item) {
+        var heading = item.querySelector('ion-label h2');
+        var toggle = item.querySelector('ion-toggle');
+        if (!heading || !toggle) {
+            return;
+        }
+        var elem = toggle.querySelector('input[name^="ion-tg-"]');
+        index.push([heading.textContent.trim(), elem ? elem.name : null, toggle]);
+    });
+    return index;
+"""
+
+# Snapshot of every switch on the page: ion-item heading -> hidden input value.
+# The hidden input is named ion-tg-N and holds 'on' when the switch is on.
+SNAPSHOT_FUNCTION_JS = """
+    function snapshotToggles() {
+        var snapshot = {};
+        document.querySelectorAll('ion-item').forEach(function (item) {
+            var heading = item.querySelector('ion-label h2');
+            var toggle = item.querySelector('ion-toggle');
+            if (!heading || !toggle) {
+                return;
+            }
+            var elem = toggle.querySelector('input[name^="ion-tg-"]');
+            snapshot[heading.textContent.trim()] = elem ? elem.value : null;
+        });
+        return snapshot;
+    }
+"""
+
+SNAPSHOT_TOGGLES_JS = SNAPSHOT_FUNCTION_JS + "return snapshotToggles();"
+
+# Installs a MutationObserver that diffs the toggle snapshot whenever the page
+# changes (our clicks, the phone app, other sessions) and appends
+# {label, value, ts} entries to an in-page queue. Safe to run more than once.
+INSTALL_OBSERVER_JS = SNAPSHOT_FUNCTION_JS + """
+    var MAX_QUEUED = 1000;
+    if (!window.__smarteefiObserver) {
+        window.__smarteefiChanges = [];
+        window.__smarteefiLast = snapshotToggles();
+        var scheduled = false;
+        window.__smarteefiObserver = new MutationObserver(function () {
+            if (scheduled) {
+                return;
+            }
+            // Diff once per burst of mutations rather than once per mutation
+            scheduled = true;
+            Promise.resolve().then(function () {
+                scheduled = false;
+                var current = snapshotToggles();
+                var now = Date.now();
+                Object.keys(current).forEach(function (label) {
+                    if (current[label] !== window.__smarteefiLast[label]) {
+                        window.__smarteefiChanges.push({label: label, value: current[label], ts: now});
+                    }
+                });
+                window.__smarteefiLast = current;
+                var excess = window.__smarteefiChanges.length - MAX_QUEUED;
+                if (excess > 0) {
+                    window.__smarteefiChanges.splice(0, excess);
+                }
+            });
+        });
+        window.__smarteefiObserver.observe(document.body, {
+            subtree: true,
+            childList: true,
+            attributes: true,
+            attributeFilter: ['class', 'aria-checked', 'checked', 'value'],
+        });
+    }
+    return {snapshot: window.__smarteefiLast, ts: Date.now()};
+"""
+
+# Hands over and clears the queued changes; null means the observer is gone
+# (e.g. the page reloaded) and has to be installed again.
+DRAIN_CHANGES_JS = """
+    if (!window.__smarteefiObserver) {
+        return null;
+    }
+    var changes = window.__smarteefiChanges;
+    window.__smarteefiChanges = [];
+    return changes;
+"""
+
+# Finds the first ion-toggle whose ion-item heading contains the label, the
+# same match toggle_switch() makes with its XPath.
+FIND_TOGGLE_JS = """
+    function findToggle(label) {
+        var items = document.querySelectorAll('ion-item');
+        for (var i = 0; i < items.length; i++) {
+            var heading = items[i].querySelector('ion-label h2');
+            var toggle = items[i].querySelector('ion-toggle');
+            if (heading && toggle && heading.textContent.indexOf(label) !== -1) {
+                return toggle;
+            }
+        }
+        return null;
+    }
+    function toggleValue(toggle) {
+        var elem = toggle.querySelector('input[name^="ion-tg-"]');
+        return elem ? elem.value : null;
+    }
+"""
+
+# Reads every requested toggle and clicks the ones not in the desired state,
+# all in a single round trip.
+APPLY_STATES_JS = FIND_TOGGLE_JS + """
+    var desired = arguments[0];
+    var results = {};
+    Object.keys(desired).forEach(function (label) {
+        var toggle = findToggle(label);
+        if (!toggle) {
+            results[label] = null;
+            return;
+        }
+        var before = toggleValue(toggle);
+        var clicked = false;
+        if ((before === 'on') !== desired[label] && !toggle.disabled) {
+            toggle.click();
+            clicked = true;
+        }
+        results[label] = {before: before, clicked: clicked, disabled: toggle.disabled};
+    });
+    return results;
+"""
+
+# Reads the current hidden input value of each requested toggle.
+READ_STATES_JS = FIND_TOGGLE_JS + """
+    var values = {};
+    arguments[0].forEach(function (label) {
+        var toggle = findToggle(label);
+        values[label] = toggle ? toggleValue(toggle) : null;
+    });
+    return values;
+"""
+
+PAGE_LOAD_JS = """
+    var nav = performance.getEntriesByType('navigation')[0];
+    if (!nav) {
+        return null;
+    }
+    return nav.loadEventEnd > 0 ? nav.loadEventEnd : nav.domContentLoadedEventEnd;
+"""
+
+# Cheap liveness probe: Chrome answers, we are past the login page and the
+# dashboard's tab bar is present.
+HEALTH_CHECK_JS = """
+    return location.pathname.indexOf('/login') === -1 && !!document.querySelector('ion-tab-bar');
+"""
+
+
+def use_home(driver, home):
+    """Make home's tab the active window of driver (no-op if it already is).
+
+    A driver without per-home tabs (or home=None) keeps its active tab.
+    """
+    if home is not None and current_home.get(driver) != home and driver in home_windows:
+        driver.switch_to.window(home_windows[driver][home])
+        current_home[driver] = home
+
+
+def open_home_tabs(driver, homes, deadline, on_changes=None):
+    """Select every configured home once, each in its own tab of driver.
+
+    With on_changes, a state observer is installed in each tab.
+    """
+    home_windows[driver] = {}
+    for position, home in enumerate(homes):
+        if position > 0:
+            driver.switch_to.new_window('tab')
+            driver.get(APP_URL)
+            wait_until(driver, EC.presence_of_element_located((By.XPATH, "//ion-tab-bar")), deadline)
+        with phase("select_home"):
+            select_home(driver, home, deadline)
+        home_windows[driver][home] = driver.current_window_handle
+        current_home[driver] = home
+        with phase("index_toggles"):
+            index_toggles(driver, home, homes[home]["devices"])
+        if on_changes is not None:
+            with phase("install_observer"):
+                install_state_observer(driver, home, on_changes)
+
+
+def index_toggles(driver, home, devices=None):
+    """Discover every ion-item toggle in home's tab and cache its element handle.
+
+    With devices (the home's config), warns about configured devices the page lacks.
+    """
+    handles = {}
+    inputs = {}
+    for label, input_name, element in driver.execute_script(INDEX_TOGGLES_JS):
+        handles.setdefault(label, element)
+        inputs.setdefault(label, input_name)
+    toggle_handles[(driver, home)] = handles
+    print(f"Indexed {len(handles)} toggle(s) in {home}: {', '.join(handles)}")
+    if devices is None:
+        return handles
+    for name, device in devices.items():
+        if device["label"] not in handles:
+            print(f"Warning: device '{name}' ({device['label']}) was not found in {home}.")
+        elif inputs[device["label"]] != device["input"]:
+            print(f"Warning: device '{name}' uses input {inputs[device['label']]}, not {device['input']} as configured.")
+    return handles
+
+
+def locate_toggle(driver, home, switch_label):
+    """Return the cached ion-toggle for switch_label, indexing the tab on first use."""
+    handles = toggle_handles.get((driver, home))
+    if handles is None:
+        handles = index_toggles(driver, home)
+    if switch_label in handles:
+        return handles[switch_label]
+    # Not an exact heading match; fall back to the partial-text XPath search
+    ion_toggle_xpath = f"//ion-item[ion-label/h2[contains(text(), '{switch_label}')]]//ion-toggle"
+    ion_toggle_elements = driver.find_elements(By.XPATH, ion_toggle_xpath)
+    print(f"Number of ion-toggle elements found for '{switch_label}': {len(ion_toggle_elements)}")
+    if not ion_toggle_elements:
+        return None
+    handles[switch_label] = ion_toggle_elements[0]
+    return ion_toggle_elements[0]
+
+
+def toggle_switch(driver, switch_label, hidden_input_name, desired_state, deadline=None, retried=False, home=None):
+    deadline = deadline or Deadline()
+    try:
+        use_home(driver, home)
+
+        # Locate the toggle element
+        with phase("locate"):
+            ion_toggle = locate_toggle(driver, home, switch_label)
+        if ion_toggle is None:
+            print(f"No ion-toggle element found for '{switch_label}'.")
+            return False, f"No ion-toggle element found for '{switch_label}'."
+
+        # Scroll the toggle into view using scrollIntoView
+        with phase("scroll"):
+            driver.execute_script("arguments[0].scrollIntoView({block: 'center', inline: 'nearest'});", ion_toggle)
+            wait_in_viewport(driver, ion_toggle, deadline)
+            print("Scrolled the toggle into view.")
+
+        # Use ActionChains to move to the toggle element
+        with phase("move"):
+            actions = ActionChains(driver)
+            actions.move_to_element(ion_toggle).perform()
+            print("Moved to the toggle element using ActionChains.")
+
+        # Wait until no overlays are present
+        with phase("overlay_wait"):
+            wait_for_overlays(driver, deadline)
+            print("No overlays present.")
+
+        if ion_toggle.is_displayed() and ion_toggle.is_enabled():
+            print("Toggle is visible and enabled.")
+        else:
+            print("Toggle is either not visible or not enabled.")
+            return False, "Toggle is either not visible or not enabled."
+
+        # JavaScript to get the hidden input's value within the toggle element
+        js = f"""
+            var elem = arguments[0].querySelector('input[name="{hidden_input_name}"]');
+            return elem ? elem.value : null;
+        """
+        # Same read by name alone, so confirming survives the toggle being re-rendered
+        confirm_js = f"""
+            var elem = document.querySelector('input[name="{hidden_input_name}"]');
+            return elem ? elem.value : null;
+        """
+        with phase("read_state"):
+            current_value = driver.execute_script(js, ion_toggle)
+        is_on = current_value == "on"
+        print(f"The {switch_label} is currently {'ON' if is_on else 'OFF'}.")
+
+        desired_state_bool = desired_state.lower() == "on"
+
+        if desired_state_bool != is_on:
+            try:
+                # Click the toggle via JavaScript
+                with phase("click"):
+                    driver.execute_script("arguments[0].click();", ion_toggle)
+                print(f"Clicked the toggle to turn the {switch_label} {'ON' if desired_state_bool else 'OFF'}.")
+
+                # Wait until the hidden input's value reflects the desired state
+                with phase("confirm_wait"):
+                    wait_until(driver, lambda d: d.execute_script(confirm_js) == ("on" if desired_state_bool else ""), deadline)
+                print(f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}.")
+                return True, f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}."
+            except TimeoutException:
+                print(f"Failed to set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}. The state did not change in time.")
+                return False, f"Failed to set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}."
+            except ElementClickInterceptedException:
+                print("Unable to click the toggle. It might be covered by another element.")
+                with phase("click_retry_wait"):
+                    wait_for_overlays(driver, deadline)
+                try:
+                    with phase("click"):
+                        driver.execute_script("arguments[0].click();", ion_toggle)
+                    print(f"Successfully clicked the toggle after waiting. {switch_label} has been turned {'ON' if desired_state_bool else 'OFF'}.")
+
+                    # Wait again for the state
+                    with phase("confirm_wait"):
+                        wait_until(driver, lambda d: d.execute_script(confirm_js) == ("on" if desired_state_bool else ""), deadline)
+                    print(f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}.")
+                    return True, f"Successfully set the {switch_label} to {'ON' if desired_state_bool else 'OFF'}."
+                except StaleElementReferenceException:
+                    raise
+                except Exception as e:
+                    print(f"Still unable to click the toggle: {e}")
+                    return False, f"Still unable to click the toggle: {e}"
+            except StaleElementReferenceException:
+                raise
+            except Exception as e:
+                print(f"An error occurred while toggling the {switch_label}: {e}")
+                return False, f"An error occurred while toggling the {switch_label}: {e}"
+        else:
+            print(f"{switch_label.capitalize()} is already {'ON' if is_on else 'OFF'}.")
+            return True, f"{switch_label.capitalize()} is already {'ON' if is_on else 'OFF'}."
+    except TimeoutException:
+        print("The toggle element was not found within the given time.")
+        return False, "The toggle element was not found within the given time."
+    except NoSuchElementException as e:
+        print(f"Toggle element not found: {e}")
+        return False, f"Toggle element not found: {e}"
+    except StaleElementReferenceException:
+        # The page re-rendered its toggles; rebuild the handle cache once
+        toggle_handles.pop((driver, home), None)
+        if retried:
+            print(f"The toggle for {switch_label} went stale again after re-indexing.")
+            return False, f"The toggle for {switch_label} went stale again after re-indexing."
+        print("Cached toggle handle went stale. Re-indexing the page and retrying.")
+        return toggle_switch(driver, switch_label, hidden_input_name, desired_state, deadline, retried=True, home=home)
+    except Exception as e:
+        print(f"An unexpected error occurred while toggling the {switch_label}: {e}")
+        return False, f"An unexpected error occurred while toggling the {switch_label}: {e}"
+
+
+def apply_switch_states(driver, desired_states, deadline=None, home=None):
+    """Set several switches in one browser pass.
+
+    desired_states maps switch labels to 'on'/'off'. Returns a dict of
+    label -> (success, message).
+    """
+    deadline = deadline or Deadline()
+    results = {}
+    try:
+        use_home(driver, home)
+
+        # Wait once for overlays instead of once per switch
+        with phase("overlay_wait"):
+            wait_for_overlays(driver, deadline)
+        print("No overlays present.")
+
+        desired_bools = {label: state.lower() == "on" for label, state in desired_states.items()}
+        with phase("batch_apply"):
+            applied = driver.execute_script(APPLY_STATES_JS, desired_bools)
+
+        pending = []
+        for label, want_on in desired_bools.items():
+            state_text = 'ON' if want_on else 'OFF'
+            outcome = applied.get(label)
+            if outcome is None:
+                results[label] = (False, f"No ion-toggle element found for '{label}'.")
+            elif outcome["clicked"]:
+                print(f"Clicked the toggle to turn the {label} {state_text}.")
+                pending.append(label)
+            elif outcome["disabled"] and (outcome["before"] == "on") != want_on:
+                results[label] = (False, "Toggle is either not visible or not enabled.")
+            else:
+                results[label] = (True, f"{label.capitalize()} is already {state_text}.")
+
+        if pending:
+            def confirmed(d):
+                values = d.execute_script(READ_STATES_JS, pending)
+                return all((values.get(label) == "on") == desired_bools[label] for label in pending)
+            try:
+                with phase("confirm_wait"):
+                    wait_until(driver, confirmed, deadline)
+            except TimeoutException:
+                pass
+            values = driver.execute_script(READ_STATES_JS, pending)
+            for label in pending:
+                state_text = 'ON' if desired_bools[label] else 'OFF'
+                if (values.get(label) == "on") == desired_bools[label]:
+                    print(f"Successfully set the {label} to {state_text}.")
+                    results[label] = (True, f"Successfully set the {label} to {state_text}.")
+                else:
+                    print(f"Failed to set the {label} to {state_text}. The state did not change in time.")
+                    results[label] = (False, f"Failed to set the {label} to {state_text}.")
+    except TimeoutException:
+        print("Overlay did not disappear within the given time.")
+        for label in desired_states:
+            results.setdefault(label, (False, "Overlay did not disappear within the given time."))
+    except Exception as e:
+        print(f"An unexpected error occurred while applying switch states: {e}")
+        for label in desired_states:
+            results.setdefault(label, (False, f"An unexpected error occurred: {e}"))
+    return results
+
+
+def read_switch_states(driver):
+    values = driver.execute_script(SNAPSHOT_TOGGLES_JS)
+    return {label: "on" if value == "on" else "off" for label, value in values.items()}
+
+
+def install_state_observer(driver, home, on_changes):
+    # Installs into the active tab, which must be home's
+    result = driver.execute_script(INSTALL_OBSERVER_JS)
+    on_changes(home, [{"label": label, "value": value, "ts": result["ts"]}
+                      for label, value in result["snapshot"].items()])
+    print(f"State observer installed for {home}.")
+
+
+def drain_state_changes(driver, on_changes):
+    for home in list(home_windows.get(driver, {})):
+        use_home(driver, home)
+        changes = driver.execute_script(DRAIN_CHANGES_JS)
+        if changes is None:
+            install_state_observer(driver, home, on_changes)
+        else:
+            on_changes(home, changes)
+
+
+def session_profile_dir(profile_root, index):
+    # Chrome cannot share a profile between running instances, so each
+    # session slot gets its own directory.
+    if not profile_root:
+        return None
+    return os.path.join(os.path.abspath(profile_root), f"session-{index}")
+
+
+def measure_page_load(driver):
+    try:
+        value = driver.execute_script(PAGE_LOAD_JS)
+    except WebDriverException:
+        return None
+    return round(value, 1) if value is not None else None
+
+
+def session_is_healthy(driver):
+    try:
+        return bool(driver.execute_script(HEALTH_CHECK_JS))
+    except Exception as e:
+        print(f"Health check failed: {e}")
+        return False
+
+
+def open_browser_session(index, homes, on_changes=None, lean=LEAN, profile_root=PROFILE_DIR):
+    """Launch Chrome, log in (or resume a saved login) and open a tab per home.
+
+    Returns (driver, page load time in ms or None).
+    """
+    profile_dir = session_profile_dir(profile_root, index)
+    # One budget covers the whole login and home selection
+    deadline = Deadline(SETUP_TIMEOUT)
+    with phase("launch"):
+        driver = init_driver(profile_dir, lean)
+    try:
+        warm = False
+        if profile_dir is not None:
+            with phase("resume"):
+                warm = resume_session(driver)
+        if not warm:
+            with phase("login"):
+                perform_login(driver, deadline)
+        open_home_tabs(driver, homes, deadline, on_changes)
+    except Exception:
+        driver.quit()
+        raise
+    page_load = measure_page_load(driver)
+    print(f"Browser for session {index} is ready ({'warm' if warm else 'cold'} start"
+          f"{', lean' if lean else ''}), page load {page_load} ms.")
+    return driver, page_load
+
+
+def close_browser_session(driver):
+    for home in home_windows.pop(driver, {}):
+        toggle_handles.pop((driver, home), None)
+    current_home.pop(driver, None)
+    driver.quit()
+
+
+class SeleniumTransport(Transport):
+    """Drives the Smarteefi web app in Chrome; each session is a WebDriver.
+
+    on_changes(home, changes) receives the tabs' MutationObserver feed; with
+    None no observers are installed.
+    """
+    name = "selenium"
+
+    def __init__(self, homes, on_changes=None, lean=LEAN, profile_dir=PROFILE_DIR):
+        self.homes = homes
+        self.on_changes = on_changes
+        self.lean = lean
+        self.profile_dir = profile_dir
+        self.page_loads = {}  # Driver -> page load time in ms when it was set up
+
+    def open_session(self, index):
+        driver, page_load = open_browser_session(index, self.homes, self.on_changes, self.lean, self.profile_dir)
+        self.page_loads[driver] = page_load
+        return driver
+
+    def close_session(self, driver):
+        self.page_loads.pop(driver, None)
+        close_browser_session(driver)
+
+    def page_load_ms(self, driver):
+        return self.page_loads.get(driver)
+
+    def is_healthy(self, driver):
+        return session_is_healthy(driver)
+
+    def read_states(self, driver, home):
+        use_home(driver, home)
+        return read_switch_states(driver)
+
+    def set_switch(self, driver, home, switch_label, hidden_input_name, desired_state, deadline):
+        return toggle_switch(driver, switch_label, hidden_input_name, desired_state, deadline, home=home)
+
+    def apply_states(self, driver, home, desired_states, deadline):
+        return apply_switch_states(driver, desired_states, deadline, home=home)
+
+    def drain_changes(self, driver):
+        if self.on_changes is not None:
+            drain_state_changes(driver, self.on_changes)
@@ -0,0 +1,279 @@
+"""Configuration and browser session setup shared by api.py and main.py.
+
+Selenium is imported inside the browser functions, so the thin CLI client
+and the HTTP transport can read the config without loading it.
+"""
+import json
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables from environment_keys.env
+load_dotenv('environment_keys.env')
+
+# Point at a local mock_smarteefi server for testing and benchmarks
+BASE_URL = os.getenv("SMARTEEFI_BASE_URL", "https://smarteefi.web.app").rstrip("/")
+LOGIN_URL = f"{BASE_URL}/login"
+APP_URL = f"{BASE_URL}/"
+EMAIL = os.getenv("SMARTEEFI_EMAIL")
+PASSWORD = os.getenv("SMARTEEFI_PASSWORD")
+# Where main.py finds the running API; a Unix socket path takes precedence
+API_URL = os.getenv("SMARTEEFI_API_URL", "http://127.0.0.1:9000").rstrip("/")
+API_SOCKET = os.getenv("SMARTEEFI_API_SOCKET")
+# Backend for switch commands: "selenium" drives the web app, "http" calls
+# the device-state API at HTTP_API directly (see transports.py). There is no
+# default HTTP_API; for the local mock it is <SMARTEEFI_BASE_URL>/mock-api.
+TRANSPORT = os.getenv("SMARTEEFI_TRANSPORT", "selenium")
+HTTP_API = os.getenv("SMARTEEFI_HTTP_API", "").rstrip("/")
+HTTP_TIMEOUT = float(os.getenv("SMARTEEFI_HTTP_TIMEOUT", "10"))
+# Lean mode runs Chrome headless in a small window with background features
+# off and blocks resources the switch pages do not need (see BLOCKED_URLS).
+LEAN = os.getenv("SMARTEEFI_LEAN", "0") == "1"
+WINDOW_SIZE = os.getenv("SMARTEEFI_WINDOW_SIZE", "480,900")
+LEAN_ARGUMENTS = [
+    "--headless=new",
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-component-update",
+    "--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication",
+    "--mute-audio",
+    "--no-first-run",
+    "--blink-settings=imagesEnabled=false",
+]
+# URL patterns blocked over CDP in lean mode: images, fonts and media, and
+# analytics hosts. Firebase (*.googleapis.com) must stay reachable for login.
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.ico", "*.mp3", "*.mp4",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*fonts.googleapis.com*", "*fonts.gstatic.com*",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*facebook.net*", "*hotjar.com*",
+] + [pattern for pattern in os.getenv("SMARTEEFI_BLOCKED_URLS", "").split(",") if pattern]
+# Directory for persistent Chrome profiles; when set, a saved Firebase login is
+# reused on restart and the full login flow only runs if it has expired.
+PROFILE_DIR = os.getenv("SMARTEEFI_PROFILE_DIR")
+RESUME_TIMEOUT = float(os.getenv("SMARTEEFI_RESUME_TIMEOUT", "15"))
+
+# Homes, devices and scenes come from a JSON config file; see devices.json
+DEVICES_FILE = os.getenv("SMARTEEFI_DEVICES_FILE",
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices.json"))
+
+
+def load_device_config(path):
+    """Return (homes, default_home) from the config file.
+
+    homes maps a home name, as shown in the home selector, to {"devices": ...,
+    "scenes": ...}. devices maps a device name to {"label": ion-item heading,
+    "input": hidden ion-tg-N input name}; scenes are returned as scene name ->
+    switch label -> 'on'/'off'.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    homes = {}
+    for home, home_config in config.get("homes", {}).items():
+        devices = home_config.get("devices", {})
+        for name, device in devices.items():
+            if "label" not in device or "input" not in device:
+                raise ValueError(f"device '{name}' in home '{home}' needs a 'label' and an 'input'")
+        scenes = {}
+        for scene_name, states in home_config.get("scenes", {}).items():
+            unknown = [name for name in states if name not in devices]
+            if unknown:
+                raise ValueError(f"scene '{scene_name}' in home '{home}' refers to unknown devices: {', '.join(unknown)}")
+            scenes[scene_name] = {devices[name]["label"]: state for name, state in states.items()}
+        homes[home] = {"devices": devices, "scenes": scenes}
+    if not homes:
+        raise ValueError("no homes configured")
+    default_home = config.get("default_home", next(iter(homes)))
+    if default_home not in homes:
+        raise ValueError(f"default_home '{default_home}' is not one of the configured homes")
+    return homes, default_home
+
+
+class SessionSetupError(Exception):
+    """Raised when a session cannot log in or select its home.
+
+    The caller owns the driver and decides whether to quit it, retry, or
+    give up; the watchdog retries in the background.
+    """
+
+
+def init_driver(profile_dir=None, lean=None):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    lean = LEAN if lean is None else lean
+    chrome_options = Options()
+    if lean:
+        for argument in LEAN_ARGUMENTS:
+            chrome_options.add_argument(argument)
+        chrome_options.add_argument(f"--window-size={WINDOW_SIZE}")
+        chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        # Every step waits for its own condition, so don't wait for the load event
+        chrome_options.page_load_strategy = "eager"
+    else:
+        chrome_options.add_argument("--start-maximized")
+    if profile_dir:
+        # Cookies, localStorage and IndexedDB (the Firebase session) live here
+        chrome_options.add_argument(f"--user-data-dir={profile_dir}")
+    driver_instance = webdriver.Chrome(options=chrome_options)
+    if lean:
+        driver_instance.execute_cdp_cmd("Network.enable", {})
+        driver_instance.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver_instance
+
+
+def perform_login(driver, deadline=None):
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from waits import Deadline, SETUP_TIMEOUT, wait_for_overlays, wait_until
+
+    deadline = deadline or Deadline(SETUP_TIMEOUT)
+    try:
+        driver.get(LOGIN_URL)
+
+        # Enter email
+        email_input = wait_until(
+            driver, EC.element_to_be_clickable((By.XPATH, "//input[@placeholder='Enter your email']")), deadline
+        )
+        email_input.clear()
+        email_input.send_keys(EMAIL)
+        print("Entered email.")
+
+        # Click Login/Signup button
+        login_button = driver.find_element(By.XPATH, "//ion-button[contains(., 'Login/Signup')]")
+        login_button.click()
+        print("Clicked Login/Signup button.")
+
+        # Wait for password page to load
+        wait_until(driver, EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Enter your password']")), deadline)
+        print("Password page loaded.")
+
+        # Enter password
+        password_input = driver.find_element(By.XPATH, "//input[@placeholder='Enter your password']")
+        password_input.clear()
+        password_input.send_keys(PASSWORD)
+        print("Entered password.")
+
+        # Click Login button
+        submit_button = driver.find_element(By.XPATH, "//ion-button[contains(., 'Login') and not(contains(., 'Signup'))]")
+        submit_button.click()
+        print("Clicked Login button.")
+
+        # Wait for dashboard to load and its loading overlay to clear
+        wait_until(driver, EC.presence_of_element_located((By.XPATH, "//ion-tab-bar")), deadline)
+        wait_for_overlays(driver, deadline)
+        print("Login successful.")
+    except TimeoutException:
+        print("Login failed: Timeout while trying to log in.")
+        raise SessionSetupError("Login failed: Timeout while trying to log in.")
+    except NoSuchElementException as e:
+        print(f"Login failed: Element not found. {e}")
+        raise SessionSetupError(f"Login failed: Element not found. {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred during login: {e}")
+        raise SessionSetupError(f"An unexpected error occurred during login: {e}")
+
+
+# Where the app landed after loading APP_URL: the dashboard, the login page
+# or (still loading) neither
+RESUME_CHECK_JS = """
+    if (document.querySelector('ion-tab-bar')) {
+        return 'dashboard';
+    }
+    if (location.pathname.indexOf('/login') !== -1
+            || document.querySelector("input[placeholder='Enter your email']")) {
+        return 'login';
+    }
+    return null;
+"""
+
+
+def resume_session(driver):
+    """Return True if the saved login in the driver's profile is still valid.
+
+    Returns False as soon as the app redirects to its login page, so a cold
+    start does not wait out RESUME_TIMEOUT.
+    """
+    from selenium.common.exceptions import TimeoutException
+    from waits import Deadline, wait_until
+
+    try:
+        driver.get(APP_URL)
+        landed = wait_until(driver, lambda d: d.execute_script(RESUME_CHECK_JS), Deadline(RESUME_TIMEOUT))
+        if landed == "login":
+            print("Saved login is missing or expired. Logging in again.")
+            return False
+        print("Resumed saved login.")
+        return True
+    except TimeoutException:
+        print("Saved login is missing or expired. Logging in again.")
+        return False
+    except Exception as e:
+        print(f"Could not resume saved login: {e}")
+        return False
+
+
+def select_home(driver, home, deadline=None):
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from waits import Deadline, SETUP_TIMEOUT, wait_for_overlays, wait_until
+
+    deadline = deadline or Deadline(SETUP_TIMEOUT)
+    try:
+        # Wait until no overlays are present
+        wait_for_overlays(driver, deadline)
+        print("No overlays present.")
+
+        # Click Home dropdown
+        dropdown = wait_until(driver, EC.element_to_be_clickable((By.XPATH, "//ion-select")), deadline)
+        dropdown.click()
+        print("Clicked Home dropdown.")
+
+        # Wait for alert popup
+        alert_xpath = "//div[contains(@class, 'alert-wrapper') and contains(@class, 'ion-overlay-wrapper')]"
+        wait_until(driver, EC.visibility_of_element_located((By.XPATH, alert_xpath)), deadline)
+        print("Alert popup appeared.")
+
+        # Select the home's option; an exact match so 'Home' cannot pick 'Beach Home'
+        home_button_xpath = f"//div[contains(@class, 'alert-wrapper')]//div[@class='alert-radio-label sc-ion-alert-md' and normalize-space(text())='{home}']/ancestor::button"
+        home_buttons = driver.find_elements(By.XPATH, home_button_xpath)
+        print(f"Number of '{home}' buttons found: {len(home_buttons)}")
+        if not home_buttons:
+            print(f"No '{home}' button found.")
+            raise SessionSetupError(f"Home '{home}' is not in the home selector.")
+        home_button = home_buttons[0]
+        home_button.click()
+        print(f"Selected '{home}' option.")
+
+        # Click 'Okay' button to confirm
+        okay_button_xpath = "//div[contains(@class, 'alert-wrapper')]//button/span[text()='Okay']"
+        okay_buttons = driver.find_elements(By.XPATH, okay_button_xpath)
+        print(f"Number of 'Okay' buttons found: {len(okay_buttons)}")
+        if not okay_buttons:
+            print("No 'Okay' button found.")
+            raise SessionSetupError(f"Could not confirm '{home}': no 'Okay' button found.")
+        okay_button = okay_buttons[0]
+        okay_button.click()
+        print("Clicked 'Okay' button.")
+
+        # Wait for alert popup to disappear
+        wait_until(driver, EC.invisibility_of_element_located((By.XPATH, alert_xpath)), deadline)
+        print(f"'{home}' selection confirmed.")
+    except SessionSetupError:
+        raise
+    except TimeoutException:
+        print(f"Failed to select '{home}': Timeout while waiting for elements.")
+        raise SessionSetupError(f"Failed to select '{home}': Timeout while waiting for elements.")
+    except NoSuchElementException as e:
+        print(f"Failed to select '{home}': Element not found. {e}")
+        raise SessionSetupError(f"Failed to select '{home}': Element not found. {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred while selecting '{home}': {e}")
+        raise SessionSetupError(f"An unexpected error occurred while selecting '{home}': {e}")
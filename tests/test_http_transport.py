@@ -0,0 +1,100 @@
+"""HttpTransport against a local mock_smarteefi server.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SMARTEEFI_EMAIL", "test@example.com")
+os.environ.setdefault("SMARTEEFI_PASSWORD", "secret")
+
+import transports  # noqa: E402
+from mock_smarteefi.server import start_in_thread  # noqa: E402
+from smarteefi import SessionSetupError  # noqa: E402
+from transports import HttpTransport  # noqa: E402
+from waits import Deadline  # noqa: E402
+
+HOMES = {"Nikoo": {}, "Home": {}}
+
+
+class HttpTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_in_thread(port=0, toggle_delay=50)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.mock = self.server.RequestHandlerClass.state
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}/mock-api"
+        self.transport = HttpTransport(HOMES, None, base_url, timeout=5)
+        self.session = self.transport.open_session(0)
+        self.addCleanup(self.transport.close_session, self.session)
+
+    def test_login(self):
+        self.assertIn(self.session.token, self.mock.tokens)
+
+    def test_login_failure(self):
+        with mock.patch.object(transports, "EMAIL", ""):
+            with self.assertRaises(SessionSetupError):
+                self.transport.open_session(1)
+
+    def test_read_states(self):
+        self.assertEqual(self.transport.read_states(self.session, "Home"),
+                         {"Light-1": "off", "Light-2": "off", "Geyser": "off"})
+
+    def test_set_switch(self):
+        success, message = self.transport.set_switch(self.session, "Nikoo", "Switch-1", None, "on", Deadline(5))
+        self.assertTrue(success, message)
+        self.assertEqual(self.transport.read_states(self.session, "Nikoo")["Switch-1"], "on")
+
+    def test_set_switch_timeout(self):
+        # The backend applies the command well after the request deadline
+        self.mock.toggle_delay = 2000
+        success, message = self.transport.set_switch(self.session, "Nikoo", "Switch-1", None, "on", Deadline(0.3))
+        self.assertFalse(success)
+        self.assertIn("Failed to set", message)
+
+    def test_set_switch_already_in_state(self):
+        success, message = self.transport.set_switch(self.session, "Nikoo", "Switch-1", None, "off", Deadline(5))
+        self.assertTrue(success)
+        self.assertIn("already OFF", message)
+        self.assertEqual(self.mock.stats()["toggles"], 0)
+
+    def test_set_switch_unknown_label(self):
+        success, _ = self.transport.set_switch(self.session, "Nikoo", "Switch-9", None, "on", Deadline(5))
+        self.assertFalse(success)
+
+    def test_set_switch_dropped_command(self):
+        self.mock.flaky = 1.0
+        success, message = self.transport.set_switch(self.session, "Nikoo", "Switch-1", None, "on", Deadline(5))
+        self.assertFalse(success)
+        self.assertIn("dropped", message)
+        self.assertEqual(self.mock.stats()["toggles"], 2)
+
+    def test_relogin_after_401(self):
+        old_token = self.session.token
+        self.mock.tokens.clear()
+        self.assertEqual(self.transport.read_states(self.session, "Nikoo")["Fan-1"], "off")
+        self.assertNotEqual(self.session.token, old_token)
+        self.assertIn(self.session.token, self.mock.tokens)
+
+    def test_is_healthy(self):
+        self.assertTrue(self.transport.is_healthy(self.session))
+
+    def test_is_healthy_when_relogin_fails(self):
+        self.mock.tokens.clear()
+        with mock.patch.object(transports, "EMAIL", ""):
+            self.assertFalse(self.transport.is_healthy(self.session))
+
+    def test_drain_changes(self):
+        changes = {}
+        self.transport.on_changes = lambda home, batch: changes.update({home: batch})
+        self.transport.drain_changes(self.session)
+        self.assertEqual(set(changes), set(HOMES))
+        self.assertEqual({change["label"] for change in changes["Home"]}, {"Light-1", "Light-2", "Geyser"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+"""Backends that carry switch commands to Smarteefi.
+
+api.py keeps its pool, locks, state cache and routes backend-agnostic and
+talks to Smarteefi only through a Transport. Each pool slot holds one
+session object returned by open_session(); the pool checks sessions out
+exclusively, so a session never needs its own locking.
+
+The Selenium backend (selenium_transport.py) drives the web app in Chrome.
+HttpTransport skips the browser and calls the backend's login and
+device-state endpoints directly, one keep-alive connection per pool slot.
+"""
+import http.client
+import json
+import time
+from urllib.parse import quote, urlsplit
+
+from smarteefi import EMAIL, HTTP_API, HTTP_TIMEOUT, PASSWORD, SessionSetupError
+
+POLL_START = 0.05  # First wait before re-reading state after a toggle
+POLL_MAX = 0.1  # Reads are cheap over a kept-alive connection
+
+
+class Transport:
+    name = None
+
+    def open_session(self, index):
+        """Log in and return a session object for pool slot index."""
+        raise NotImplementedError
+
+    def close_session(self, session):
+        raise NotImplementedError
+
+    def is_healthy(self, session):
+        raise NotImplementedError
+
+    def page_load_ms(self, session):
+        """Page load time measured when the session was set up, if the backend has one."""
+        return None
+
+    def read_states(self, session, home):
+        """Return {label: 'on'/'off'} for every switch in home."""
+        raise NotImplementedError
+
+    def set_switch(self, session, home, switch_label, hidden_input_name, desired_state, deadline):
+        """Set one switch and return (success, message)."""
+        raise NotImplementedError
+
+    def apply_states(self, session, home, desired_states, deadline):
+        """Set several switches; return {label: (success, message)}."""
+        raise NotImplementedError
+
+    def drain_changes(self, session):
+        """Feed switch changes seen since the last call to the state table."""
+        raise NotImplementedError
+
+
+class HttpError(Exception):
+    pass
+
+
+class HttpSession:
+    def __init__(self, index, connection):
+        self.index = index
+        self.connection = connection
+        self.token = None
+
+
+class HttpTransport(Transport):
+    """Talks to the device-state API over HTTP instead of through a browser.
+
+    on_changes(home, changes) receives polled states in the same shape the
+    browser's MutationObserver feed uses.
+    """
+    name = "http"
+
+    def __init__(self, homes, on_changes, base_url=HTTP_API, timeout=HTTP_TIMEOUT):
+        self.homes = homes
+        self.on_changes = on_changes
+        url = urlsplit(base_url.rstrip("/"))
+        self.https = url.scheme == "https"
+        self.netloc = url.netloc
+        self.path = url.path
+        self.timeout = timeout
+
+    def connect(self):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.netloc, timeout=self.timeout)
+
+    def request(self, session, method, path, body=None, retried=False):
+        """Send one request on the session's connection and return (status, JSON body)."""
+        headers = {"Content-Type": "application/json"}
+        if session.token:
+            headers["Authorization"] = f"Bearer {session.token}"
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            session.connection.request(method, self.path + path, data, headers)
+            response = session.connection.getresponse()
+            payload = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            # The server may have closed an idle keep-alive connection; reconnect
+            # once. Commands set absolute values, so resending one is safe.
+            session.connection.close()
+            if retried:
+                raise HttpError(f"{method} {path} failed: {e}")
+            return self.request(session, method, path, body, retried=True)
+        if response.status == 401 and session.token and not retried:
+            print(f"HTTP session {session.index} token was rejected. Logging in again.")
+            self.login(session)
+            return self.request(session, method, path, body, retried=True)
+        try:
+            return response.status, json.loads(payload or b"{}")
+        except ValueError:
+            raise HttpError(f"{method} {path} returned invalid JSON (status {response.status}).")
+
+    def login(self, session):
+        session.token = None
+        try:
+            status, body = self.request(session, "POST", "/login", {"email": EMAIL, "password": PASSWORD})
+        except HttpError as e:
+            raise SessionSetupError(f"Login failed: {e}")
+        if status != 200 or not body.get("idToken"):
+            raise SessionSetupError(f"Login failed: status {status}, {body.get('error', 'no token returned')}.")
+        session.token = body["idToken"]
+
+    def open_session(self, index):
+        session = HttpSession(index, self.connect())
+        try:
+            self.login(session)
+        except Exception:
+            session.connection.close()
+            raise
+        return session
+
+    def close_session(self, session):
+        session.connection.close()
+
+    def is_healthy(self, session):
+        try:
+            status, _ = self.request(session, "GET", f"/state?home={quote(next(iter(self.homes)))}")
+        except Exception as e:
+            # Includes a failed re-login after the token was rejected
+            print(f"Health check failed: {e}")
+            return False
+        return status == 200
+
+    def read_states(self, session, home):
+        status, body = self.request(session, "GET", f"/state?home={quote(home)}")
+        if status != 200:
+            raise HttpError(f"Reading {home} failed with status {status}.")
+        return {device["label"]: "on" if device["value"] == "on" else "off" for device in body["devices"]}
+
+    def set_switch(self, session, home, switch_label, hidden_input_name, desired_state, deadline):
+        return self.apply_states(session, home, {switch_label: desired_state}, deadline)[switch_label]
+
+    def send_toggle(self, session, home, label, state):
+        return self.request(session, "POST", "/toggle",
+                            {"home": home, "label": label, "value": "on" if state == "on" else ""})
+
+    def apply_states(self, session, home, desired_states, deadline):
+        results = {}
+        try:
+            states = self.read_states(session, home)
+            pending = []
+            for label, state in desired_states.items():
+                state = state.lower()
+                if label not in states:
+                    print(f"No switch named '{label}' in {home}.")
+                    results[label] = (False, f"No switch named '{label}' in {home}.")
+                elif states[label] == state:
+                    print(f"{label.capitalize()} is already {state.upper()}.")
+                    results[label] = (True, f"{label.capitalize()} is already {state.upper()}.")
+                else:
+                    status, body = self.send_toggle(session, home, label, state)
+                    if status < 400 and body.get("accepted") is False:
+                        # Commands set absolute values, so resending a dropped one is safe
+                        print(f"Switch command for {label} was dropped. Sending it again.")
+                        status, body = self.send_toggle(session, home, label, state)
+                    if status >= 400:
+                        results[label] = (False, f"Switch command for {label} was refused (status {status}).")
+                    elif body.get("accepted") is False:
+                        print(f"Switch command for {label} was dropped twice.")
+                        results[label] = (False, f"Switch command for {label} was dropped by the backend.")
+                    else:
+                        print(f"Sent the command to turn the {label} {state.upper()}.")
+                        pending.append(label)
+
+            # The backend applies commands asynchronously; poll until they land
+            delay = POLL_START
+            while pending and deadline.remaining() > 0:
+                time.sleep(min(delay, deadline.remaining()))
+                delay = min(delay * 1.5, POLL_MAX)
+                states = self.read_states(session, home)
+                pending = [label for label in pending if states.get(label) != desired_states[label].lower()]
+            for label, state in desired_states.items():
+                if label in results:
+                    continue
+                state_text = state.upper()
+                if label in pending:
+                    print(f"Failed to set the {label} to {state_text}. The state did not change in time.")
+                    results[label] = (False, f"Failed to set the {label} to {state_text}.")
+                else:
+                    print(f"Successfully set the {label} to {state_text}.")
+                    results[label] = (True, f"Successfully set the {label} to {state_text}.")
+        except (HttpError, SessionSetupError) as e:
+            print(f"An error occurred while applying switch states: {e}")
+            for label in desired_states:
+                results.setdefault(label, (False, f"An error occurred: {e}"))
+        return results
+
+    def drain_changes(self, session):
+        # No push feed over plain HTTP, so each drain is a poll of every home
+        for home in self.homes:
+            now_ms = time.time() * 1000
+            states = self.read_states(session, home)
+            self.on_changes(home, [{"label": label, "value": state, "ts": now_ms}
+                                   for label, state in states.items()])
@@ -0,0 +1,79 @@
+"""Deadline-driven waits shared by every browser step.
+
+A request gets one Deadline; each step polls its own readiness condition with
+backoff until the condition holds or the request's remaining time runs out,
+instead of sleeping a fixed time or starting a fresh 60 second wait.
+
+Selenium is imported inside the wait functions, so Deadline can be used by
+code that never starts a browser.
+"""
+import os
+import time
+
+REQUEST_TIMEOUT = float(os.getenv("SMARTEEFI_REQUEST_TIMEOUT", "60"))  # Budget for one command
+SETUP_TIMEOUT = float(os.getenv("SMARTEEFI_SETUP_TIMEOUT", "120"))  # Budget for login + home selection
+POLL_INITIAL = float(os.getenv("SMARTEEFI_POLL_INITIAL", "0.05"))
+POLL_BACKOFF = float(os.getenv("SMARTEEFI_POLL_BACKOFF", "1.5"))
+POLL_MAX = float(os.getenv("SMARTEEFI_POLL_MAX", "0.5"))
+
+IN_VIEWPORT_JS = """
+    var rect = arguments[0].getBoundingClientRect();
+    var height = window.innerHeight || document.documentElement.clientHeight;
+    return rect.height > 0 && rect.top >= 0 && rect.bottom <= height;
+"""
+
+
+class Deadline:
+    def __init__(self, seconds=REQUEST_TIMEOUT):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def wait_until(driver, condition, deadline, message="", poll=None, backoff=None, max_poll=None):
+    """Poll condition(driver) until it returns something truthy and return that.
+
+    Raises TimeoutException once the deadline has passed. The poll interval
+    starts at poll and grows by backoff up to max_poll.
+    """
+    from selenium.common.exceptions import (
+        NoSuchElementException,
+        StaleElementReferenceException,
+        TimeoutException,
+    )
+
+    interval = POLL_INITIAL if poll is None else poll
+    backoff = POLL_BACKOFF if backoff is None else backoff
+    max_poll = POLL_MAX if max_poll is None else max_poll
+    while True:
+        try:
+            value = condition(driver)
+            if value:
+                return value
+        except (NoSuchElementException, StaleElementReferenceException):
+            pass
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise TimeoutException(message or f"Condition not met within {deadline.seconds:.0f}s.")
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_poll)
+
+
+def wait_for_overlays(driver, deadline):
+    """Wait until no ion-backdrop overlay is visible."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    wait_until(driver, EC.invisibility_of_element_located((By.CSS_SELECTOR, "ion-backdrop")),
+               deadline, "Overlay did not disappear in time.")
+
+
+def wait_in_viewport(driver, element, deadline):
+    """Wait until element is laid out inside the viewport (scrolling has finished)."""
+    wait_until(driver, lambda d: d.execute_script(IN_VIEWPORT_JS, element),
+               deadline, "Element did not scroll into view in time.")